@@ -0,0 +1,238 @@
+"""代理性能基准：比较直连后端和经过代理的吞吐量、延迟和内存增长
+
+默认在同一进程中启动 server.py 的 ExampleService 和代理，客户端、代理和后端共享 GIL，
+结果适合比较不同场景和版本之间的差异；--subprocess 时后端和代理各自运行在单独的进程中。
+内存增长是代理进程的常驻内存变化，只有 --subprocess 时才能单独测量，进程内运行时不输出。
+"""
+import os
+import gc
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent import futures
+import grpc
+from google.protobuf import descriptor_pb2
+import server
+import proto.example_pb2 as example_pb2
+import proto.example_pb2_grpc as example_pb2_grpc
+from channel_pool import ChannelPool
+from headless import HeadlessRecorder
+from replay import Replayer, ReplayCall, REPLAY_PERCENTILES
+from proxy_engine import GenericServicer, PassthroughHandler, AioProxyHandler, method_table
+
+# 后端和代理使用的端口
+BENCH_BACKEND_PORT = 50061
+BENCH_PROXY_PORT = 50062
+# 场景：direct 直连后端，passthrough 透传，decoded 解码后转发，intercept 全部拦截并自动放行，aio 使用 grpc.aio 引擎
+BENCH_SCENARIOS = ("direct", "passthrough", "decoded", "intercept", "aio")
+# 每个场景正式计时前的预热时间（秒）
+BENCH_WARMUP = 1.0
+
+SERVICE = example_pb2.DESCRIPTOR.services_by_name["ExampleService"]
+
+
+def rss_bytes(pid):
+    """进程当前的常驻内存（字节），只支持有 /proc 的系统，其他系统返回 None"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def wait_ready(target, timeout=10):
+    with grpc.insecure_channel(target) as channel:
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+
+
+def make_calls(workload, payload_size, stream_messages):
+    # 按负载类型生成请求，双向流每个调用发送 stream_messages 条消息
+    methods = method_table(SERVICE)
+    request = example_pb2.ExampleRequest(message="x" * payload_size).SerializeToString()
+    if workload == "unary":
+        return [ReplayCall(methods["UnaryMethod"], request)]
+    return [ReplayCall(methods["BiDiStream"], [request] * stream_messages)]
+
+
+class InProcessProxy:
+    """在当前进程中启动的代理，使用无界面的记录器"""
+    def __init__(self, scenario, upstream, port):
+        self.recorder = HeadlessRecorder(intercept=".*" if scenario == "intercept" else None)
+        self.upstream = upstream
+        self.aio = scenario == "aio"
+        if self.aio:
+            # 事件循环在后台线程中运行，代理的启动和停止都提交到这个循环
+            self.loop = asyncio.new_event_loop()
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self.start_aio(port), self.loop).result()
+            return
+        self.channel = ChannelPool([upstream])
+        servicer = GenericServicer(self.recorder, SERVICE, self.channel)
+        handler = servicer.rpc_handler() if scenario == "decoded" else PassthroughHandler(servicer, self.channel)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=100))
+        self.server.add_generic_rpc_handlers((handler,))
+        self.server.add_insecure_port(f"127.0.0.1:{port}")
+        self.server.start()
+
+    async def start_aio(self, port):
+        # aio 连接需要在运行代理的事件循环中创建
+        self.channel = ChannelPool([self.upstream], aio=True)
+        self.sync_channel = ChannelPool([self.upstream], 1)
+        servicer = GenericServicer(self.recorder, SERVICE, self.sync_channel)
+        self.server = grpc.aio.server()
+        self.server.add_generic_rpc_handlers((AioProxyHandler(servicer, self.channel),))
+        self.server.add_insecure_port(f"127.0.0.1:{port}")
+        await self.server.start()
+
+    async def stop_aio(self):
+        await self.server.stop(0)
+        await self.channel.close()
+
+    def pid(self):
+        # 与客户端和后端在同一进程中，没有单独的进程可以测量内存
+        return None
+
+    def stop(self):
+        if self.aio:
+            asyncio.run_coroutine_threadsafe(self.stop_aio(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.sync_channel.close()
+        else:
+            self.server.stop(0)
+            self.channel.close()
+
+
+class SubprocessProxy:
+    """以 headless.py 子进程运行的代理"""
+    def __init__(self, scenario, upstream, port, workdir):
+        descriptor_path = os.path.join(workdir, "example.pb")
+        file_proto = descriptor_pb2.FileDescriptorProto()
+        example_pb2.DESCRIPTOR.CopyToProto(file_proto)
+        with open(descriptor_path, "wb") as f:
+            f.write(descriptor_pb2.FileDescriptorSet(file=[file_proto]).SerializeToString())
+        command = [sys.executable, "headless.py", "-d", descriptor_path, "-u", upstream, "-p", str(port),
+                   "-o", os.path.join(workdir, "captures"), "--cache-dir", ""]
+        if scenario == "aio":
+            command.append("--aio")
+        if scenario == "intercept":
+            command += ["--intercept", ".*"]
+        self.process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+        wait_ready(f"127.0.0.1:{port}")
+
+    def pid(self):
+        return self.process.pid
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def start_backend(port, use_subprocess):
+    if use_subprocess:
+        # server.py 固定监听 50051
+        process = subprocess.Popen([sys.executable, "server.py"], cwd=os.path.dirname(os.path.abspath(__file__)))
+        wait_ready("127.0.0.1:50051")
+        return "127.0.0.1:50051", process.terminate
+    backend = grpc.server(futures.ThreadPoolExecutor(max_workers=100))
+    example_pb2_grpc.add_ExampleServiceServicer_to_server(server.ExampleService(), backend)
+    backend.add_insecure_port(f"127.0.0.1:{port}")
+    backend.start()
+    return f"127.0.0.1:{port}", lambda: backend.stop(0)
+
+
+def run_load(target, calls, concurrency, duration):
+    channel = ChannelPool([target])
+    try:
+        Replayer(channel, calls, concurrency=concurrency, loops=0, duration=BENCH_WARMUP).run()
+        return Replayer(channel, calls, concurrency=concurrency, loops=0, duration=duration).run()
+    finally:
+        channel.close()
+
+
+def run_scenario(scenario, backend, args, workdir):
+    """返回每种负载和消息大小的结果行"""
+    if scenario == "decoded" and args.subprocess:
+        print("decoded 场景需要关闭 PASSTHROUGH，只能在进程内运行，跳过")
+        return []
+    proxy = None
+    target = backend
+    if scenario != "direct":
+        if args.subprocess:
+            proxy = SubprocessProxy(scenario, backend, BENCH_PROXY_PORT, workdir)
+        else:
+            proxy = InProcessProxy(scenario, backend, BENCH_PROXY_PORT)
+        target = f"127.0.0.1:{BENCH_PROXY_PORT}"
+    # 只测量单独运行的代理进程，进程内的读数包含客户端和后端，不能说明代理的内存增长
+    pid = proxy.pid() if proxy is not None else None
+    rows = []
+    try:
+        for workload in args.workloads:
+            for payload_size in args.payload_sizes:
+                calls = make_calls(workload, payload_size, args.stream_messages)
+                gc.collect()
+                rss_before = rss_bytes(pid) if pid is not None else None
+                report = run_load(target, calls, args.concurrency, args.duration)
+                gc.collect()
+                rss_after = rss_bytes(pid) if pid is not None else None
+                ((_, count, errors, qps, latencies),) = report.rows()
+                rows.append({"scenario": scenario, "workload": workload, "payload": payload_size,
+                             "calls": count, "errors": errors, "qps": qps,
+                             **{f"p{p}_ms": latency for p, latency in zip(REPLAY_PERCENTILES, latencies)},
+                             "rss_growth_mb": (rss_after - rss_before) / 1048576 if None not in (rss_before, rss_after) else None})
+                print(format_row(rows[-1]))
+    finally:
+        if proxy is not None:
+            proxy.stop()
+    return rows
+
+
+def format_row(row):
+    growth = "" if row["rss_growth_mb"] is None else f"{row['rss_growth_mb']:+.1f}"
+    return (f"{row['scenario']:<12}{row['workload']:<8}{row['payload']:>8}{row['calls']:>9}{row['errors']:>7}"
+            f"{row['qps']:>10.1f}" + "".join(f"{row[f'p{p}_ms']:>10.2f}" for p in REPLAY_PERCENTILES) + f"{growth:>10}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="比较直连和经过代理的吞吐量、延迟和内存增长")
+    parser.add_argument("-s", "--scenarios", default=",".join(BENCH_SCENARIOS),
+                        help=f"逗号分隔的场景，可选 {','.join(BENCH_SCENARIOS)}")
+    parser.add_argument("-w", "--workloads", default="unary,bidi", help="逗号分隔的负载类型：unary、bidi")
+    parser.add_argument("-b", "--payload-sizes", default="16,1024,65536", help="逗号分隔的请求消息大小（字节）")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="同时进行的调用数")
+    parser.add_argument("-t", "--duration", type=float, default=5.0, help="每组测试的时间（秒）")
+    parser.add_argument("--stream-messages", type=int, default=10, help="双向流每个调用发送的消息数")
+    parser.add_argument("--subprocess", action="store_true", help="后端和代理在单独的进程中运行")
+    parser.add_argument("--json", help="把结果写入 JSON 文件，便于比较不同版本")
+    args = parser.parse_args(argv)
+    args.scenarios = args.scenarios.split(",")
+    args.workloads = args.workloads.split(",")
+    args.payload_sizes = [int(size) for size in args.payload_sizes.split(",")]
+    unknown = set(args.scenarios) - set(BENCH_SCENARIOS) or set(args.workloads) - {"unary", "bidi"}
+    if unknown:
+        parser.error(f"未知的场景或负载: {','.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backend, stop_backend = start_backend(BENCH_BACKEND_PORT, args.subprocess)
+    print(f"{'场景':<10}{'负载':<6}{'大小':>6}{'调用':>7}{'错误':>5}{'次/秒':>8}"
+          + "".join(f"{f'p{p}(ms)':>10}" for p in REPLAY_PERCENTILES) + f"{'内存(MB)':>8}")
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for scenario in args.scenarios:
+                rows.extend(run_scenario(scenario, backend, args, workdir))
+    finally:
+        stop_backend()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
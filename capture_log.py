@@ -0,0 +1,155 @@
+import os
+import json
+import mmap
+import struct
+import threading
+import queue
+import traceback
+from array import array
+
+# 单个分段文件的大小上限，超过后切换到新的分段
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_PATTERN = "capture-{:06d}.log"
+
+# 每条记录的头部：元数据、请求、响应三段的长度
+HEADER = struct.Struct("<III")
+
+
+class CaptureLog:
+    """磁盘上的分段抓包日志
+
+    每条记录依次写入 [头部][元数据 JSON][请求字节][响应字节]，分段文件超过
+    segment_max_bytes 后切换到下一个。内存中只保存每条记录所在的分段和偏移，
+    读取时通过 mmap 访问，几 GB 的日志也不需要载入内存。
+    """
+    def __init__(self, directory, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segments = array("I")  # 每条记录所在的分段序号
+        self.offsets = array("Q")   # 每条记录在分段中的偏移
+        self.maps = {}              # 分段序号 -> (mmap, 映射时的文件大小)
+        self.lock = threading.Lock()
+        self.writer = None
+        self.segment = 0
+        self.segment_size = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_PATTERN.format(segment))
+
+    def load_index(self):
+        # 只读取每条记录的头部来重建偏移索引，跳过负载
+        segment = 1
+        while os.path.exists(self.segment_path(segment)):
+            size = os.path.getsize(self.segment_path(segment))
+            with open(self.segment_path(segment), "rb") as f:
+                offset = 0
+                while offset + HEADER.size <= size:
+                    f.seek(offset)
+                    lengths = HEADER.unpack(f.read(HEADER.size))
+                    end = offset + HEADER.size + sum(lengths)
+                    if end > size:
+                        break  # 写入中断留下的不完整记录
+                    self.segments.append(segment)
+                    self.offsets.append(offset)
+                    offset = end
+            self.segment, self.segment_size = segment, offset
+            segment += 1
+
+    def append(self, meta, request, response):
+        """追加一条记录，返回它在日志中的序号"""
+        meta = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        data = HEADER.pack(len(meta), len(request), len(response)) + meta + request + response
+        with self.lock:
+            if self.writer is None or (self.segment_size and self.segment_size + len(data) > self.segment_max_bytes):
+                self.rotate()
+            self.writer.write(data)
+            self.writer.flush()
+            self.segments.append(self.segment)
+            self.offsets.append(self.segment_size)
+            self.segment_size += len(data)
+            return len(self.offsets) - 1
+
+    def rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.segment == 0 or self.segment_size:
+            self.segment += 1
+            self.segment_size = 0
+        self.writer = open(self.segment_path(self.segment), "ab")
+
+    def view(self, segment, end):
+        # 返回覆盖到 end 的只读映射，正在写入的分段变大后重新映射
+        mapped = self.maps.get(segment)
+        if mapped is None or mapped[1] < end:
+            if mapped is not None:
+                mapped[0].close()
+            with open(self.segment_path(segment), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                mapped = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), size)
+            self.maps[segment] = mapped
+        return mapped[0]
+
+    def read_meta(self, index):
+        segment, offset = self.segments[index], self.offsets[index]
+        with self.lock:
+            data = self.view(segment, offset + HEADER.size)
+            meta_len, _, _ = HEADER.unpack_from(data, offset)
+            data = self.view(segment, offset + HEADER.size + meta_len)
+            start = offset + HEADER.size
+            return json.loads(data[start:start + meta_len].decode("utf-8"))
+
+    def read(self, index):
+        """返回 (元数据, 请求字节, 响应字节)"""
+        segment, offset = self.segments[index], self.offsets[index]
+        with self.lock:
+            data = self.view(segment, offset + HEADER.size)
+            meta_len, request_len, response_len = HEADER.unpack_from(data, offset)
+            data = self.view(segment, offset + HEADER.size + meta_len + request_len + response_len)
+            start = offset + HEADER.size
+            meta = json.loads(data[start:start + meta_len].decode("utf-8"))
+            start += meta_len
+            request = data[start:start + request_len]
+            start += request_len
+            response = data[start:start + response_len]
+        return meta, request, response
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            for mapped, _ in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+
+
+class CaptureSink:
+    """在后台线程中把记录写入 CaptureLog，转发线程不等待磁盘"""
+    def __init__(self, capture_log):
+        self.log = capture_log
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, meta, request, response):
+        self.queue.put((meta, request, response))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.log.append(*item)
+            except Exception:
+                print(traceback.format_exc())
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.log.close()
@@ -0,0 +1,158 @@
+import re
+import json
+import time
+import random
+from proxy_engine import RawMessage, RawMessageList
+
+# 调用结束时的状态，之后不再更新记录
+FINAL_STATUSES = ("成功", "出错")
+
+
+class CapturePolicy:
+    """一个方法或服务的抓包策略
+
+    method 是在方法路径（/包名.服务/方法）中查找的正则，只写服务名即可匹配整个服务。
+    sample 是抓包的比例；metadata_only 为 true 时只记录方法、时间、状态和消息大小；
+    max_payload 是保存消息内容的字节上限，超过时只记录大小，流式调用保存到上限为止；
+    errors 为 true 或设置了 slow_ms 时调用先在内存中暂存，结束时出错或耗时不少于 slow_ms
+    毫秒才记录。
+    """
+    def __init__(self, method, sample=1.0, metadata_only=False, max_payload=None, errors=False, slow_ms=None):
+        self.pattern = re.compile(method)
+        self.sample = sample
+        self.max_payload = 0 if metadata_only else max_payload
+        self.errors = errors
+        self.slow = slow_ms / 1000 if slow_ms is not None else None
+        self.deferred = errors or slow_ms is not None
+
+    def content(self, content):
+        # 按大小上限处理要记录的内容，返回实际交给记录器的内容
+        if self.max_payload is None or content is None or isinstance(content, str):
+            return content
+        if isinstance(content, RawMessageList):
+            content.max_bytes = self.max_payload
+            return content
+        size = len(content.data) if isinstance(content, RawMessage) else content.ByteSize()
+        if size <= self.max_payload:
+            return content
+        return f"（{size} 字节，未保存内容）"
+
+    def keep(self, status, elapsed):
+        # 暂存的调用结束时是否记录
+        if self.errors and status == "出错":
+            return True
+        return self.slow is not None and elapsed >= self.slow
+
+
+def load_capture_policies(path):
+    """从 JSON 文件读取策略列表，按顺序使用第一条匹配的策略，没有匹配的方法完整记录"""
+    with open(path, encoding="utf-8") as f:
+        return [CapturePolicy(**policy) for policy in json.load(f)]
+
+
+class PendingCall:
+    """暂存的调用，结束时再决定是否交给记录器"""
+    __slots__ = ("policy", "arrival", "start", "request", "response", "error")
+
+    def __init__(self, policy, arrival):
+        self.policy = policy
+        self.arrival = arrival  # log_request_arrival 的参数
+        self.start = time.perf_counter()
+        self.request = None
+        self.response = None
+        self.error = None
+
+
+class CaptureRouter:
+    """按抓包策略包装界面或 HeadlessRecorder，实现相同的回调接口
+
+    没有抽中的调用返回 None 作为请求 id，之后的回调直接返回，不创建记录也不保存消息；
+    只记录出错或慢调用时返回 PendingCall，结束时满足条件才交给记录器。被拦截的调用需要
+    在界面上操作，总是完整记录。
+    """
+    def __init__(self, gui, policies):
+        self.gui = gui
+        self.policies = list(policies)
+        self.by_path = {}  # 方法路径 -> 策略，None 表示完整记录
+        self.limited = {}  # 请求 id -> 策略，只包含需要处理内容的调用
+
+    def __getattr__(self, name):
+        # hold、show_response 等只有被拦截的调用才会用到，直接交给记录器
+        return getattr(self.gui, name)
+
+    def should_intercept(self, method_name):
+        return self.gui.should_intercept(method_name)
+
+    def policy_for(self, path):
+        try:
+            return self.by_path[path]
+        except KeyError:
+            policy = self.by_path[path] = next((p for p in self.policies if p.pattern.search(path)), None)
+            return policy
+
+    def log_request_arrival(self, servicer_name, method_name, request, methods, stub):
+        policy = self.policy_for(methods[method_name].path)
+        if policy is None or self.gui.should_intercept(method_name):
+            return self.gui.log_request_arrival(servicer_name, method_name, request, methods, stub)
+        if policy.sample < 1 and random.random() >= policy.sample:
+            if isinstance(request, RawMessageList):
+                request.max_bytes = 0
+            return None
+        if policy.deferred:
+            pending = PendingCall(policy, (servicer_name, method_name, methods, stub))
+            pending.request = policy.content(request)
+            return pending
+        request_id = self.gui.log_request_arrival(servicer_name, method_name, policy.content(request), methods, stub)
+        if policy.max_payload is not None:
+            self.limited[request_id] = policy
+        return request_id
+
+    def log_response(self, request_id, response):
+        if request_id is None:
+            if isinstance(response, RawMessageList):
+                response.max_bytes = 0
+        elif type(request_id) is PendingCall:
+            request_id.response = request_id.policy.content(response)
+        else:
+            policy = self.limited.get(request_id)
+            self.gui.log_response(request_id, policy.content(response) if policy is not None else response)
+
+    def set_request(self, request_id, content):
+        if request_id is None:
+            return
+        if type(request_id) is PendingCall:
+            request_id.request = request_id.policy.content(content)
+            return
+        policy = self.limited.get(request_id)
+        self.gui.set_request(request_id, policy.content(content) if policy is not None else content)
+
+    def highlight_error(self, request_id, error_message):
+        if request_id is None:
+            return
+        if type(request_id) is PendingCall:
+            request_id.error = error_message
+            self.update_status(request_id, "出错")
+            return
+        self.gui.highlight_error(request_id, error_message)
+
+    def update_status(self, request_id, status):
+        if request_id is None:
+            return
+        if type(request_id) is not PendingCall:
+            if status in FINAL_STATUSES:
+                self.limited.pop(request_id, None)
+            self.gui.update_status(request_id, status)
+            return
+        if status not in FINAL_STATUSES or request_id.arrival is None:
+            return
+        pending, request_id.arrival = request_id.arrival, None  # 只处理一次
+        if not request_id.policy.keep(status, time.perf_counter() - request_id.start):
+            return
+        # 满足条件时补记整个调用，记录的时间是调用结束的时间
+        servicer_name, method_name, methods, stub = pending
+        real_id = self.gui.log_request_arrival(servicer_name, method_name, request_id.request, methods, stub)
+        if request_id.response is not None:
+            self.gui.log_response(real_id, request_id.response)
+        if request_id.error is not None:
+            self.gui.highlight_error(real_id, request_id.error)
+        self.gui.update_status(real_id, status)
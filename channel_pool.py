@@ -0,0 +1,184 @@
+import time
+import asyncio
+import functools
+import itertools
+import threading
+import grpc
+
+# 每个后端地址建立的连接数，一个 HTTP/2 连接的并发流数量有限
+CHANNELS_PER_TARGET = 4
+# 选择连接的策略："round_robin" 轮询，"least_outstanding" 选择进行中调用最少的连接
+LB_POLICY = "round_robin"
+# 空闲时发送 keepalive ping 的间隔和等待响应的超时（毫秒）
+KEEPALIVE_TIME_MS = 30000
+KEEPALIVE_TIMEOUT_MS = 10000
+# 收发消息的大小上限（字节）
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+# 连续多少次 UNAVAILABLE 后暂时不再选择这个连接
+UNHEALTHY_AFTER_FAILURES = 3
+# 不健康的连接经过多少秒后重新参与选择，重试的调用再次失败时重新计时
+UNHEALTHY_RETRY_SECONDS = 5.0
+
+
+def channel_options(keepalive_time_ms=KEEPALIVE_TIME_MS, keepalive_timeout_ms=KEEPALIVE_TIMEOUT_MS,
+                    max_message_bytes=MAX_MESSAGE_BYTES):
+    return [
+        ("grpc.keepalive_time_ms", keepalive_time_ms),
+        ("grpc.keepalive_timeout_ms", keepalive_timeout_ms),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.max_send_message_length", max_message_bytes),
+        ("grpc.max_receive_message_length", max_message_bytes),
+        # 参数相同的 channel 默认共享底层连接，每个 channel 使用自己的子通道才能真正分散负载
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+
+
+class PooledChannel:
+    """连接池中的一个连接及其健康状态"""
+    __slots__ = ("target", "channel", "outstanding", "failures", "retry_at", "state")
+
+    def __init__(self, target, channel):
+        self.target = target
+        self.channel = channel
+        self.outstanding = 0    # 进行中的调用数
+        self.failures = 0       # 连续失败次数
+        self.retry_at = 0.0     # 失败次数达到上限后，重新参与选择的时间（time.monotonic）
+        self.state = None       # 最近一次的连接状态，aio 连接不订阅状态时为 None
+
+    @property
+    def healthy(self):
+        if self.state in (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN):
+            return False
+        # aio 连接没有连接状态，只能靠重试的调用成功来恢复
+        return self.failures < UNHEALTHY_AFTER_FAILURES or time.monotonic() >= self.retry_at
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= UNHEALTHY_AFTER_FAILURES:
+            self.retry_at = time.monotonic() + UNHEALTHY_RETRY_SECONDS
+
+    def on_state(self, state):
+        self.state = state
+        if state == grpc.ChannelConnectivity.READY:
+            self.failures = 0
+
+
+class ChannelPool:
+    """多个后端地址、每个地址多个连接的上游连接池
+
+    提供与 grpc channel 相同的 unary_unary/unary_stream/stream_unary/stream_stream
+    方法，可以直接替代 channel 传给生成的 Stub、PassthroughHandler 和 AioProxyHandler。
+    每次调用时按策略选择一个健康的连接，全部不健康时仍在所有连接中选择。
+    """
+    def __init__(self, targets, channels_per_target=CHANNELS_PER_TARGET, policy=LB_POLICY, options=None, aio=False):
+        if isinstance(targets, str):
+            targets = [targets]
+        if policy not in ("round_robin", "least_outstanding"):
+            raise ValueError(f"未知的负载均衡策略: {policy}")
+        self.policy = policy
+        self.aio = aio
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        options = channel_options() if options is None else options
+        make_channel = grpc.aio.insecure_channel if aio else grpc.insecure_channel
+        self.channels = []
+        for target in targets:
+            for _ in range(channels_per_target):
+                pooled = PooledChannel(target, make_channel(target, options=options))
+                if not aio:
+                    # aio channel 不支持订阅，只按调用结果判断健康状态
+                    pooled.channel.subscribe(pooled.on_state, try_to_connect=True)
+                self.channels.append(pooled)
+
+    def pick(self):
+        candidates = [pooled for pooled in self.channels if pooled.healthy] or self.channels
+        if self.policy == "least_outstanding":
+            return min(candidates, key=lambda pooled: pooled.outstanding)
+        return candidates[next(self.counter) % len(candidates)]
+
+    def acquire(self):
+        with self.lock:
+            pooled = self.pick()
+            pooled.outstanding += 1
+        return pooled
+
+    def release(self, pooled, code):
+        with self.lock:
+            pooled.outstanding -= 1
+            if code == grpc.StatusCode.UNAVAILABLE:
+                pooled.failed()
+            elif code is not None:
+                pooled.failures = 0
+
+    def stats(self):
+        """每个连接的 (地址, 进行中的调用数, 是否健康)"""
+        with self.lock:
+            return [(pooled.target, pooled.outstanding, pooled.healthy) for pooled in self.channels]
+
+    def unary_unary(self, method, *args, **kwargs):
+        return PooledMultiCallable(self, "unary_unary", method, args, kwargs)
+
+    def unary_stream(self, method, *args, **kwargs):
+        return PooledMultiCallable(self, "unary_stream", method, args, kwargs)
+
+    def stream_unary(self, method, *args, **kwargs):
+        return PooledMultiCallable(self, "stream_unary", method, args, kwargs)
+
+    def stream_stream(self, method, *args, **kwargs):
+        return PooledMultiCallable(self, "stream_stream", method, args, kwargs)
+
+    def close(self):
+        # aio 连接池返回需要 await 的协程
+        if self.aio:
+            return asyncio.gather(*(pooled.channel.close() for pooled in self.channels))
+        for pooled in self.channels:
+            pooled.channel.unsubscribe(pooled.on_state)
+            pooled.channel.close()
+
+
+class PooledMultiCallable:
+    """每次调用时从连接池中选择连接的 multi-callable"""
+    def __init__(self, pool, kind, method, args, kwargs):
+        self.pool = pool
+        self.kind = kind
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.callables = {}  # 连接 -> 这个连接上的 multi-callable
+
+    def get(self, pooled):
+        # 每个连接上的 multi-callable 只创建一次
+        callable_ = self.callables.get(pooled)
+        if callable_ is None:
+            callable_ = self.callables[pooled] = getattr(pooled.channel, self.kind)(self.method, *self.args, **self.kwargs)
+        return callable_
+
+    def __call__(self, request, *args, **kwargs):
+        pool = self.pool
+        pooled = pool.acquire()
+        try:
+            result = self.get(pooled)(request, *args, **kwargs)
+        except grpc.RpcError as e:
+            # 同步的一元调用直接返回结果或抛出异常
+            pool.release(pooled, e.code())
+            raise
+        except BaseException:
+            pool.release(pooled, None)
+            raise
+        if hasattr(result, "add_done_callback"):
+            # 流式调用和 aio 调用在结束时释放
+            result.add_done_callback(functools.partial(self.on_done, pooled))
+        else:
+            pool.release(pooled, grpc.StatusCode.OK)
+        return result
+
+    def on_done(self, pooled, call):
+        code = call.code()
+        if asyncio.iscoroutine(code):
+            # aio 调用的状态码需要在事件循环上取得
+            task = asyncio.ensure_future(code)
+            task.add_done_callback(lambda task: self.pool.release(
+                pooled, None if task.cancelled() or task.exception() else task.result()))
+        else:
+            self.pool.release(pooled, code)
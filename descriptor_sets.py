@@ -0,0 +1,211 @@
+import os
+import hashlib
+import traceback
+import grpc
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+# 描述文件的扩展名，传入目录时只加载这些文件
+DESCRIPTOR_SET_SUFFIXES = (".pb", ".desc", ".protoset")
+# 合并后的描述集缓存目录，None 表示不缓存
+DESCRIPTOR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "grpc_proxy")
+# 通过 gRPC 反射读取服务描述时调用的方法和超时秒数
+REFLECTION_METHOD = "/grpc.reflection.v1alpha.ServerReflection/ServerReflectionInfo"
+REFLECTION_TIMEOUT = 10
+
+
+def expand_paths(paths):
+    """把目录展开为其中的描述文件，按文件名排序"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.endswith(DESCRIPTOR_SET_SUFFIXES))
+        else:
+            files.append(path)
+    return files
+
+
+def cache_key(files):
+    # 文件路径、大小和修改时间都不变时直接使用缓存
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def merge_descriptor_sets(files):
+    """合并多个 protoc --descriptor_set_out 生成的文件，去重并按依赖顺序排列"""
+    file_protos = []
+    for path in files:
+        file_set = descriptor_pb2.FileDescriptorSet()
+        with open(path, "rb") as f:
+            file_set.ParseFromString(f.read())
+        file_protos.extend(file_set.file)
+    return order_files(file_protos)
+
+
+def order_files(file_protos):
+    # 同名文件只保留第一个，依赖排在引用它的文件之前
+    by_name = {}
+    for file_proto in file_protos:
+        by_name.setdefault(file_proto.name, file_proto)
+
+    merged = descriptor_pb2.FileDescriptorSet()
+    done = set()
+
+    def add(name):
+        if name in done or name not in by_name:
+            return  # 缺少的依赖可能已经在默认的 descriptor pool 中
+        done.add(name)
+        file_proto = by_name[name]
+        for dependency in file_proto.dependency:
+            add(dependency)
+        merged.file.add().CopyFrom(file_proto)
+
+    for name in by_name:
+        add(name)
+    return merged
+
+
+def load_descriptor_set(paths, cache_dir=DESCRIPTOR_CACHE_DIR):
+    """读取描述文件并返回合并后的 FileDescriptorSet
+
+    合并结果按输入文件的大小和修改时间缓存到 cache_dir，重启后只需读取一个文件。
+    """
+    files = expand_paths(paths)
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, cache_key(files) + ".pb")
+        if os.path.exists(cache_path):
+            merged = descriptor_pb2.FileDescriptorSet()
+            with open(cache_path, "rb") as f:
+                merged.ParseFromString(f.read())
+            return merged
+
+    merged = merge_descriptor_sets(files)
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再替换，避免中断后留下不完整的缓存
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(merged.SerializeToString())
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            print(traceback.format_exc())
+    return merged
+
+
+_reflection_classes = None
+
+def reflection_classes():
+    """返回反射协议的 (请求类, 响应类)
+
+    只定义用到的字段，注册在单独的 descriptor pool 中，不依赖 grpcio-reflection，
+    也不会和上游服务自己的反射描述冲突。
+    """
+    global _reflection_classes
+    if _reflection_classes is None:
+        T = descriptor_pb2.FieldDescriptorProto
+        file_proto = descriptor_pb2.FileDescriptorProto(name="grpc_proxy_reflection.proto", package="grpc.reflection.v1alpha",
+                                                        syntax="proto3")
+
+        def message(name, *fields, oneof=None):
+            # oneof 中的字段即使是空字符串也会写入请求，list_services 依赖这一点
+            message_proto = file_proto.message_type.add(name=name)
+            if oneof:
+                message_proto.oneof_decl.add(name=oneof)
+            for field_name, number, field_type, label, type_name, in_oneof in fields:
+                field = message_proto.field.add(name=field_name, number=number, type=field_type, label=label)
+                if type_name:
+                    field.type_name = type_name
+                if in_oneof:
+                    field.oneof_index = 0
+
+        optional, repeated = T.LABEL_OPTIONAL, T.LABEL_REPEATED
+        message("ServerReflectionRequest",
+                ("host", 1, T.TYPE_STRING, optional, None, False),
+                ("file_by_filename", 3, T.TYPE_STRING, optional, None, True),
+                ("file_containing_symbol", 4, T.TYPE_STRING, optional, None, True),
+                ("list_services", 7, T.TYPE_STRING, optional, None, True), oneof="message_request")
+        message("FileDescriptorResponse", ("file_descriptor_proto", 1, T.TYPE_BYTES, repeated, None, False))
+        message("ServiceResponse", ("name", 1, T.TYPE_STRING, optional, None, False))
+        message("ListServiceResponse", ("service", 1, T.TYPE_MESSAGE, repeated, ".grpc.reflection.v1alpha.ServiceResponse", False))
+        message("ErrorResponse", ("error_code", 1, T.TYPE_INT32, optional, None, False),
+                ("error_message", 2, T.TYPE_STRING, optional, None, False))
+        message("ServerReflectionResponse",
+                ("file_descriptor_response", 4, T.TYPE_MESSAGE, optional, ".grpc.reflection.v1alpha.FileDescriptorResponse", True),
+                ("list_services_response", 6, T.TYPE_MESSAGE, optional, ".grpc.reflection.v1alpha.ListServiceResponse", True),
+                ("error_response", 7, T.TYPE_MESSAGE, optional, ".grpc.reflection.v1alpha.ErrorResponse", True),
+                oneof="message_response")
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(file_proto)
+        _reflection_classes = tuple(message_factory.GetMessageClass(pool.FindMessageTypeByName(f"grpc.reflection.v1alpha.{name}"))
+                                    for name in ("ServerReflectionRequest", "ServerReflectionResponse"))
+    return _reflection_classes
+
+
+def reflect_descriptor_set(target, timeout=REFLECTION_TIMEOUT):
+    """通过上游服务的 gRPC 反射接口读取全部服务的描述，返回按依赖顺序排列的 FileDescriptorSet
+
+    反射结果反映上游当前部署的版本，不写入磁盘缓存。
+    """
+    request_class, response_class = reflection_classes()
+    files = {}
+    with grpc.insecure_channel(target) as channel:
+        call = channel.stream_stream(REFLECTION_METHOD, request_serializer=request_class.SerializeToString,
+                                     response_deserializer=response_class.FromString)
+
+        def ask(requests):
+            # 每批请求用一次双向流，响应与请求按顺序一一对应
+            responses = list(call(iter(requests), timeout=timeout))
+            for response in responses:
+                if response.HasField("error_response"):
+                    raise RuntimeError(f"反射请求失败：{response.error_response.error_message}")
+                for data in response.file_descriptor_response.file_descriptor_proto:
+                    file_proto = descriptor_pb2.FileDescriptorProto.FromString(data)
+                    files.setdefault(file_proto.name, file_proto)
+            return responses
+
+        listed = ask([request_class(list_services="")])[0].list_services_response.service
+        names = [service.name for service in listed if not service.name.startswith("grpc.reflection.")]
+        ask([request_class(file_containing_symbol=name) for name in names])
+        # 服务端通常一起返回依赖的文件，缺少的依赖按文件名补齐，默认 pool 中已有的不再请求
+        pool = descriptor_pool.Default()
+        while True:
+            missing = set()
+            for file_proto in files.values():
+                for dependency in file_proto.dependency:
+                    if dependency not in files:
+                        try:
+                            pool.FindFileByName(dependency)
+                        except KeyError:
+                            missing.add(dependency)
+            if not missing:
+                break
+            ask([request_class(file_by_filename=name) for name in sorted(missing)])
+    return order_files(list(files.values()))
+
+
+def load_services(paths, cache_dir=DESCRIPTOR_CACHE_DIR, pool=None, reflection=None):
+    """把描述集加入 descriptor pool，返回其中定义的全部 ServiceDescriptor
+
+    默认使用全局的 descriptor pool，抓包日志解码时也能找到这些消息类型；
+    已经加载过的文件（例如生成的 *_pb2 模块导入的）直接跳过。reflection 是上游地址时
+    还通过 gRPC 反射读取该服务的描述，与描述文件中重复的服务只返回一次。
+    """
+    pool = pool or descriptor_pool.Default()
+    file_protos = list(load_descriptor_set(paths, cache_dir).file) if paths else []
+    if reflection:
+        file_protos.extend(reflect_descriptor_set(reflection).file)
+    services = {}
+    for file_proto in file_protos:
+        try:
+            pool.FindFileByName(file_proto.name)
+        except KeyError:
+            pool.AddSerializedFile(file_proto.SerializeToString())
+        package = file_proto.package + "." if file_proto.package else ""
+        for service in file_proto.service:
+            services.setdefault(package + service.name, pool.FindServiceByName(package + service.name))
+    return list(services.values())
@@ -1,229 +1,559 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 import grpc
 from concurrent import futures
-from google.protobuf.json_format import MessageToJson, MessageToDict, ParseDict
-from google.protobuf.descriptor import FieldDescriptor
 from datetime import datetime
 import json
+import time
 import traceback
 import re
 import threading
-import logging
-import time
-import queue
+import asyncio
+import collections
+import os
+import bisect
+import argparse
+from array import array
+from capture_log import CaptureLog, CaptureSink
+from descriptor_sets import load_services, DESCRIPTOR_CACHE_DIR
+from channel_pool import ChannelPool, CHANNELS_PER_TARGET, LB_POLICY
+from replay import Replayer, calls_from_records, request_payload, REPLAY_TARGET, REPLAY_CONCURRENCY
+from metrics import registry, start_metrics_server, METRICS_PORT
+from response_cache import ResponseCache, parse_cache_rules
+from rules import RuleSet
+from capture_policy import CaptureRouter, load_capture_policies
+from proxy_engine import (PASSTHROUGH, HOLD_TIMEOUT, HOLD_TIMEOUT_ACTION, HeldCall, CaptureStore, SessionStore,
+                          encode_record, RawMessage, RawMessageList, render_message, dict_to_message,
+                          LoggingInterceptor, BaseServicer,
+                          PassthroughHandler, AioProxyHandler, start_generic_server, start_aio_generic_server)
+
+# 使用基于 grpc.aio 的代理引擎，所有调用共享一个事件循环
+USE_AIO = False
+# 抓包日志目录，设置后每次启动在其中新建一个会话，把完成的调用追加写入磁盘；None 表示不写盘
+CAPTURE_LOG_DIR = None
+# 搜索框停止输入多久后再过滤列表（毫秒）
+SEARCH_DEBOUNCE_MS = 250
+# 界面批量刷新的间隔（毫秒）和每次最多处理的更新事件数
+UI_TICK_MS = 100
+UI_BATCH_LIMIT = 5000
+# 请求列表的默认行高（像素），主题没有设置 rowheight 时用来计算可见行数
+LIST_ROW_HEIGHT = 20
+# 统计窗口的刷新间隔（毫秒）
+STATS_REFRESH_MS = 1000
+# 重新发送的默认并发数和每次调用的超时（秒）
+RESEND_WORKERS = 8
+RESEND_TIMEOUT = 30
+
+# 搜索中可以指定的字段，对应 CaptureRecord.text 的字段序号
+SEARCH_FIELDS = {"method": 0, "server": 1, "request": 2, "req": 2, "response": 3, "resp": 3, "status": "status"}
+_REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+# 以空白分隔的条件，引号中的空白不分隔；反斜杠原样保留给正则
+_SEARCH_TOKEN = re.compile(r"""(?:[^\s"']+|"[^"]*"|'[^']*'|["'])+""")
+_QUOTED = re.compile(r""""([^"]*)"|'([^']*)'""")
+
+class SearchQuery:
+    """搜索框中的查询条件
+
+    以空格分隔的条件都要满足，不区分大小写。"字段:正则" 只匹配该字段，字段可以是
+    method、server、status、request(req)、response(resp)；不带字段的条件匹配方法名、
+    服务名、请求或响应中的任意一个。包含空格的条件用引号括起，只去掉括住整个条件的引号，
+    例如 resp:'"id": 7'。无效的正则按普通文本匹配。
+    """
+    def __init__(self, text):
+        self.text = text
+        self.terms = []
+        # 每个条件的 (字段, 普通文本)，只要有一个条件是正则就为 None
+        self.literals = []
+        for token in _SEARCH_TOKEN.findall(text):
+            name, sep, pattern = token.partition(":")
+            if sep and name.lower() in SEARCH_FIELDS:
+                field = SEARCH_FIELDS[name.lower()]
+            else:
+                field, pattern = None, token
+            quoted = _QUOTED.fullmatch(pattern)
+            if quoted:
+                pattern = quoted.group(1) if quoted.group(1) is not None else quoted.group(2)
+            pattern = pattern.lower()
+            try:
+                regex = re.compile(pattern)
+            except re.error:
+                regex = re.compile(re.escape(pattern))
+            self.terms.append((field, regex))
+            if self.literals is not None:
+                self.literals = None if _REGEX_CHARS.search(pattern) else self.literals + [(field, pattern)]
+        # 状态或响应变化后结果可能改变
+        self.dynamic = any(field in (None, 3, "status") for field, _ in self.terms)
+
+    def matches(self, record, store, render):
+        # 字段的小写文本由 store.text 生成并缓存
+        for field, regex in self.terms:
+            if field == "status":
+                if not regex.search(record.status.lower()):
+                    return False
+            elif field is None:
+                if not any(regex.search(store.text(record, i, render)) for i in range(4)):
+                    return False
+            elif not regex.search(store.text(record, field, render)):
+                return False
+        return True
+
+    def refines(self, other):
+        # 每个旧条件都被更严格的新条件替代时，新结果一定是旧结果的子集
+        if other is None or other.literals is None or self.literals is None:
+            return False
+        if len(self.literals) < len(other.literals):
+            return False
+        return all(field == old_field and old_pattern in pattern
+                   for (field, pattern), (old_field, old_pattern) in zip(self.literals, other.literals))
+
+class ProxyConfig:
+    """gRPC 线程读取的界面配置快照
+
+    创建后不再修改，输入框变化时主线程生成新的快照整体替换 GRPCProxyApp.config，gRPC 线程
+    只读取属性，不访问 Tk 控件。拦截方法是忽略大小写的正则，无效的正则按普通文本匹配；
+    decisions 缓存每个方法名是否拦截，同一个拦截条件下每个方法只匹配一次。
+    """
+    __slots__ = ("intercept_text", "intercept", "search", "decisions")
+
+    def __init__(self, intercept_text="", search=None):
+        self.intercept_text = intercept_text.strip()
+        self.intercept = None
+        if self.intercept_text:
+            try:
+                self.intercept = re.compile(self.intercept_text, re.IGNORECASE)
+            except re.error:
+                self.intercept = re.compile(re.escape(self.intercept_text), re.IGNORECASE)
+        self.search = search if search is not None else SearchQuery("")
+        self.decisions = {}  # 方法名 -> 是否拦截
+
+    def with_search(self, search):
+        # 只替换搜索条件，拦截条件不变，沿用已有的拦截结果
+        config = ProxyConfig(self.intercept_text, search)
+        config.decisions = self.decisions
+        return config
 
-EXTRA_BODY = {"UnaryMethodRequest": "ExampleRequest",
-              "UnaryMethodResponse": "ExampleResponse"
-              }
-BIDISTREAM_METHODS = ["BiDiStream"]
+    def should_intercept(self, method_name):
+        decision = self.decisions.get(method_name)
+        if decision is None:
+            decision = self.decisions[method_name] = (self.intercept is not None
+                                                      and self.intercept.search(method_name) is not None)
+        return decision
 
-stream_handle_template = '''
-def {0}ForwardReq(up_queue):
-    while True:
+# GUI 应用程序
+class VirtualRequestList:
+    """只创建可见行的请求列表
+
+    ids 按升序保存当前过滤结果中全部记录的 id，Treeview 中只保留窗口内的几十行，
+    滚动时复用这些行显示其他记录，行的内容按需从 store 中读取，几百万条记录也
+    不会创建对应数量的控件。选中状态按记录 id 保存，滚出窗口后不会丢失。
+    """
+    def __init__(self, parent, store, on_select):
+        self.store = store
+        self.on_select = on_select
+        self.ids = array("Q")
+        self.start = 0          # 窗口第一行在 ids 中的位置
+        self.rows = 1           # 窗口行数，随控件高度变化
+        self.items = []         # 窗口内的 Treeview 行
+        self.row_items = {}     # 记录 id -> Treeview 行，只包含窗口内的记录
+        self.item_rows = {}     # Treeview 行 -> 记录 id
+        self.selected = set()   # 选中的记录 id
+        self.dirty = False
+
+        self.tree = ttk.Treeview(parent, columns=("Time", "Servicer", "Method", "Status"), show="headings", selectmode="extended")
+        self.tree.heading("Time", text="时间")
+        self.tree.heading("Servicer", text="服务名")
+        self.tree.heading("Method", text="方法名")
+        self.tree.heading("Status", text="状态")
+        self.tree.column("Time", width=140)
+        self.tree.column("Servicer", width=120)
+        self.tree.column("Method", width=180)
+        self.tree.column("Status", width=100)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree.tag_configure('error', background='yellow', foreground='red')
         try:
-            if not up_queue.empty():
-                req = up_queue.get(True, 5)
-                yield req
-            else:
-                time.sleep(5)
-        except Exception as e:
-            print(traceback.format_exc())
-            
-def {0}Forward(down_queue, context, fun, req):
-    metadata = context.invocation_metadata()
-    backend_response = fun(req, metadata=metadata)
-    for response in backend_response:
-        down_queue.put(response)
-
-t = threading.Thread(target={0}Forward, args=(self.pipes[name]["down_queue"], context, fun, {0}ForwardReq(self.pipes[name]["up_queue"])))
-t.start()
-'''
-
-def get_real_body_name(pb2, name, type):
-    k = name + type
-    if k in EXTRA_BODY.keys():
-        k = EXTRA_BODY[k]
-    return getattr(pb2, k)
-
-def message_to_dict_with_defaults(proto_obj):
-    def process_field(field_value, field_descriptor):
-        """处理嵌套字段"""
-        if field_descriptor.type == FieldDescriptor.TYPE_MESSAGE:
-            # 如果字段是消息类型，递归调用以处理嵌套字段
-            return message_to_dict_with_defaults(field_value)
-        return field_value
-
-    result = {}
-    # 将现有字段的内容转换为字典
-    proto_dict = MessageToDict(proto_obj)
-
-    for field in proto_obj.DESCRIPTOR.fields:
-        field_name = field.name
-        if field_name in proto_dict:
-            # 已设置的字段，处理嵌套情况
-            if field.type == FieldDescriptor.TYPE_MESSAGE:
-                result[field_name] = process_field(proto_obj.__getattribute__(field_name), field)
-            else:
-                result[field_name] = proto_dict[field_name]
+            self.row_height = int(ttk.Style().lookup("Treeview", "rowheight")) or LIST_ROW_HEIGHT
+        except (ValueError, tk.TclError):
+            self.row_height = LIST_ROW_HEIGHT
+
+        # 滚动条直接控制窗口位置，不使用 Treeview 自身的滚动
+        self.scrollbar = ttk.Scrollbar(parent, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.tree.bind('<Configure>', self.on_configure)
+        self.tree.bind('<MouseWheel>', self.on_wheel)
+        self.tree.bind('<Button-4>', self.on_wheel)
+        self.tree.bind('<Button-5>', self.on_wheel)
+        self.tree.bind('<Up>', lambda event: self.move_selection(-1))
+        self.tree.bind('<Down>', lambda event: self.move_selection(1))
+        self.tree.bind('<Prior>', lambda event: self.move_selection(-self.rows))
+        self.tree.bind('<Next>', lambda event: self.move_selection(self.rows))
+        # 普通单击重新选择，Ctrl/Shift 单击在原有选择上追加
+        self.tree.bind('<Button-1>', self.on_click)
+        self.tree.bind('<Control-Button-1>', lambda event: None)
+        self.tree.bind('<Shift-Button-1>', lambda event: None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, record_id):
+        position = bisect.bisect_left(self.ids, record_id)
+        return position < len(self.ids) and self.ids[position] == record_id
+
+    def selected_ids(self):
+        return sorted(self.selected)
+
+    def set_ids(self, ids):
+        # 替换全部过滤结果，ids 按升序排列
+        self.ids = array("Q", ids)
+        self.start = 0
+        self.selected = {record_id for record_id in self.selected if record_id in self}
+        self.render()
+
+    def insert(self, record_id):
+        # 新记录的 id 最大，通常直接追加到末尾
+        ids = self.ids
+        if not ids or record_id > ids[-1]:
+            position = len(ids)
+            ids.append(record_id)
         else:
-            # 未设置的字段，填充默认值
-            if field.label == FieldDescriptor.LABEL_REPEATED:
-                # 默认值为空列表
-                result[field_name] = []
-            elif field.type == FieldDescriptor.TYPE_MESSAGE:
-                # 对嵌套消息类型调用递归
-                result[field_name] = message_to_dict_with_defaults(proto_obj.__getattribute__(field_name))
-            else:
-                # 直接设置为字段默认值
-                result[field_name] = field.default_value
-
-    return result
-
-def message_to_dict_str_with_defaults(proto_obj):
-    return json.dumps(message_to_dict_with_defaults(proto_obj), indent=4, ensure_ascii=False)
-
-class LoggingInterceptor(grpc.ServerInterceptor):
-    def __init__(self, gui, server_name):
-        self.gui = gui
-        self.server_name = server_name
-
-    def intercept_service(self, continuation, handler_call_details):
-        # 检查方法是否已实现
-        method_name = handler_call_details.method
-
-        # 调用链中的下一个处理程序
-        handler = continuation(handler_call_details)
-
-        if handler is None:
-            # 记录未实现的方法调用
-            print(f"方法 {method_name} 未添加到mock服务{self.server_name}")
-            return grpc.unary_unary_rpc_method_handler(
-                lambda request, context: context.abort(grpc.StatusCode.UNIMPLEMENTED, 'Method not implemented')
-            )
-
-        return handler
-    
-class BaseServicer():
-    def __init__(self, gui):
-        self.gui = gui
-        self.pipes = {}
-
-    def __getattribute__(self, name):
-        attr = super().__getattribute__(name)
-        def basic_handle(request, context):
-            metadata = context.invocation_metadata()
-            request_id = self.gui.log_request_arrival(self.server_name, name, request, self.pb2, self.stub)
-            try:
-                # 检查请求是否应该被拦截
-                if self.gui.should_intercept(name):
-                    self.gui.wait_for_request_release(request_id)
-                    if self.gui.request_states[request_id]['request_ready'] == "transfer":
-                    
-                        # 从 UI 捕获修改后的请求内容
-                        modified_request_json = self.gui.get_request_content(request_id)
-
-                        # 用修改后的内容更新存储的请求
-                        self.gui.requests[request_id] = modified_request_json
-
-                        # 将 JSON 解析为消息
-                        modified_request_dict = json.loads(modified_request_json)
-                        
-                        request_proto = get_real_body_name(self.pb2, name, "Request")()
-                        modified_request = ParseDict(modified_request_dict, request_proto)
-
-                        # 转发请求并获取响应
-                        response = getattr(self.stub, name)(modified_request, metadata=metadata)
-                        if hasattr(response, 'DESCRIPTOR'):
-                            self.gui.log_response(request_id, response)
-                            response_json = message_to_dict_str_with_defaults(response)
-                        else:
-                            print("响应不是有效的 protobuf 消息对象")
-                            response_json = "非常规响应，不能修改:\n" + str(list(response))
-                        
-                    else:
-                        response = get_real_body_name(self.pb2, name, "Response")()
-                        response_json = message_to_dict_str_with_defaults(response)
-                        self.gui.responses[request_id] = response_json
-                    self.gui.set_response_content(request_id, response_json)
-                    self.gui.wait_for_response_release(request_id)
-                    if hasattr(response, 'DESCRIPTOR'):
-                        response_json = self.gui.get_response_content(request_id)
-                        response_proto = get_real_body_name(self.pb2, name, "Response")()
-                        response = ParseDict(json.loads(response_json), response_proto)
-                        # 直接将响应返回给请求者
-                    self.gui.update_status(request_id, "成功")
-                    return response
-                else:
-                    try:
-                        get_real_body_name(self.pb2, name, "Request")()
-                        get_real_body_name(self.pb2, name, "Response")()
-                    except Exception as e:
-                        print(e)
-                    response = getattr(self.stub, name)(request, metadata=metadata)
-                    if hasattr(response, 'DESCRIPTOR'):
-                        response_json = message_to_dict_str_with_defaults(response)
-                        self.gui.log_response(request_id, response)
-                        response_json = json.dumps(json.loads(response_json), indent=4, ensure_ascii=False)
-                        self.gui.responses[request_id] = response_json
-                        self.gui.update_status(request_id, "成功")
-                        return response
-                    else:
-                        r_list = []
-                        for r in response:
-                            r_list.append(json.loads(message_to_dict_str_with_defaults(r)))
-                        self.gui.responses[request_id] = json.dumps(r_list, indent=4, ensure_ascii=False)
-                        self.gui.update_status(request_id, "成功")
-                        return iter(r_list)
-              
-            except Exception as e:
-                self.gui.highlight_error(request_id, str(e))
-                self.gui.update_status(request_id, "出错")
-                print(traceback.format_exc())
-                context.set_code(grpc.StatusCode.UNKNOWN)
-                return
-        # 处理请求和响应都为流类型的方法
-        def stream_handle(request_iter, context):
-            
-            if not name in self.pipes.keys():
-                try:     
-                    self.pipes[name] = {"up_queue": queue.Queue(), "down_queue": queue.Queue()}
-                    fun = getattr(self.stub, name)
-                    exec(stream_handle_template.format(name))
-                except Exception as e:
-                    print(traceback.format_exc())
-            for request in request_iter:
-                request_id = self.gui.log_request_arrival(self.server_name, name, request, self.pb2, self.stub)
-                self.pipes[name]["up_queue"].put(request)  # 将消息放入队列
-                res = None
-                while True:
-                    try:
-                        if not self.pipes[name]["down_queue"].empty():
-                            response = self.pipes[name]["down_queue"].get(True, 5)
-                            response_json = message_to_dict_str_with_defaults(response)
-                            self.gui.log_response(request_id, response)
-                            response_json = json.dumps(json.loads(response_json), indent=4, ensure_ascii=False)
-                            self.gui.responses[request_id] = response_json
-                            self.gui.update_status(request_id, "成功")
-                            res = response
-                            break
-                        else:
-                            time.sleep(5)
-                    except Exception as e:
-                        print(traceback.format_exc())
-                if res:
-                    yield res
-            
-        if callable(attr):
-            if name not in BIDISTREAM_METHODS:
-                return basic_handle
+            position = bisect.bisect_left(ids, record_id)
+            ids.insert(position, record_id)
+        if position < self.start:
+            self.start += 1  # 保持窗口显示的记录不变
+        self.dirty = True
+
+    def remove(self, record_ids):
+        # 淘汰的总是最旧的记录，位于 ids 开头，整段一次删除，不逐条移动整个数组
+        ids = self.ids
+        positions = []
+        for record_id in set(record_ids):
+            position = bisect.bisect_left(ids, record_id)
+            if position < len(ids) and ids[position] == record_id:
+                positions.append(position)
+                self.selected.discard(record_id)
+        if not positions:
+            return
+        positions.sort()
+        prefix = 0
+        while prefix < len(positions) and positions[prefix] == prefix:
+            prefix += 1
+        for position in reversed(positions[prefix:]):
+            del ids[position]
+        del ids[:prefix]
+        self.start -= bisect.bisect_left(positions, self.start)
+        self.dirty = True
+
+    def update(self, record):
+        # 窗口内的记录状态变化后刷新这一行，窗口外的记录滚动到时再读取
+        item = self.row_items.get(record.id)
+        if item is not None:
+            self.tree.item(item, values=record.values(), tags=record.tags())
+
+    def clear(self):
+        self.ids = array("Q")
+        self.start = 0
+        self.selected.clear()
+        self.render()
+
+    def refresh(self):
+        if self.dirty:
+            self.render()
+
+    def render(self):
+        # 把窗口内的记录写入复用的 Treeview 行
+        self.dirty = False
+        total = len(self.ids)
+        self.start = max(0, min(self.start, total - self.rows))
+        window = self.ids[self.start:self.start + self.rows]
+        while len(self.items) < len(window):
+            self.items.append(self.tree.insert("", tk.END, values=("", "", "", "")))
+        if len(self.items) > len(window):
+            self.tree.delete(*self.items[len(window):])
+            del self.items[len(window):]
+        self.row_items.clear()
+        self.item_rows.clear()
+        selected = []
+        for item, record_id in zip(self.items, window):
+            # 浏览会话时只读取窗口内记录的元数据
+            row = self.store.row(record_id)
+            if row is None:
+                self.tree.item(item, values=("", "", "", ""), tags=())
             else:
-                return stream_handle         
+                self.tree.item(item, values=row[0], tags=row[1])
+            self.row_items[record_id] = item
+            self.item_rows[item] = record_id
+            if record_id in self.selected:
+                selected.append(item)
+        # 选中的行没有变化时不重新设置，避免触发多余的选择事件
+        if set(selected) != set(self.tree.selection()):
+            self.tree.selection_set(selected)
+        if total:
+            self.scrollbar.set(self.start / total, min(1.0, (self.start + self.rows) / total))
         else:
-            return attr
-          
+            self.scrollbar.set(0.0, 1.0)
+
+    def yview(self, *args):
+        # 滚动条的回调："moveto 比例" 或 "scroll 数量 units/pages"
+        if args[0] == "moveto":
+            self.start = int(float(args[1]) * len(self.ids))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self.start += step * self.rows if args[2] == "pages" else step
+        self.render()
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.yview("scroll", -3, "units")
+        else:
+            self.yview("scroll", 3, "units")
+        return "break"
+
+    def on_configure(self, event):
+        # 减去一行留给表头
+        rows = max(1, event.height // self.row_height - 1)
+        if rows != self.rows:
+            self.rows = rows
+            self.render()
+
+    def on_click(self, event):
+        if self.tree.identify_region(event.x, event.y) == "cell":
+            self.selected.clear()
+
+    def on_tree_select(self, event):
+        # 窗口外的选中记录保持不变，窗口内的以 Treeview 为准
+        visible = set(self.item_rows.values())
+        self.selected = {record_id for record_id in self.selected if record_id not in visible}
+        self.selected.update(self.item_rows[item] for item in self.tree.selection() if item in self.item_rows)
+        self.on_select(event)
+
+    def move_selection(self, step):
+        # 键盘移动到窗口边缘时滚动窗口
+        record_id = self.item_rows.get(self.tree.focus())
+        if record_id is None or not self.ids:
+            return "break"
+        position = max(0, min(len(self.ids) - 1, bisect.bisect_left(self.ids, record_id) + step))
+        if position < self.start:
+            self.start = position
+        elif position >= self.start + self.rows:
+            self.start = position - self.rows + 1
+        self.selected = {self.ids[position]}
+        self.render()
+        self.tree.focus(self.row_items[self.ids[position]])
+        return "break"
+
+class ReplayDialog:
+    """重放选中请求的窗口，在后台线程中运行 Replayer 并显示按方法统计的结果"""
+    FIELDS = (("target", "目标地址", REPLAY_TARGET), ("qps", "每秒调用数(0 不限)", "0"),
+              ("concurrency", "并发数", str(REPLAY_CONCURRENCY)), ("loops", "轮数(0 循环)", "1"),
+              ("duration", "最长时间(秒)", ""), ("jitter", "随机延迟(毫秒)", "0"))
+
+    def __init__(self, root, calls):
+        self.root = root
+        self.calls = calls
+        self.replayer = None
+        self.channel = None
+        self.closed = False
+        self.window = tk.Toplevel(root)
+        self.window.title(f"重放 {len(calls)} 个请求")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.entries = {}
+        for row, (name, label, default) in enumerate(self.FIELDS):
+            ttk.Label(self.window, text=label).grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            entry = ttk.Entry(self.window)
+            entry.insert(0, default)
+            entry.grid(row=row, column=1, sticky=tk.W + tk.E, padx=5, pady=2)
+            self.entries[name] = entry
+        self.start_button = ttk.Button(self.window, text="开始", command=self.start)
+        self.start_button.grid(row=len(self.FIELDS), column=0, padx=5, pady=5)
+        self.stop_button = ttk.Button(self.window, text="停止", command=self.stop)
+        self.stop_button.grid(row=len(self.FIELDS), column=1, sticky=tk.W, padx=5, pady=5)
+        self.result_text = tk.Text(self.window, height=12, width=90)
+        self.result_text.grid(row=len(self.FIELDS) + 1, column=0, columnspan=2, sticky=tk.W + tk.E, padx=5, pady=5)
+
+    def show(self, content):
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, content)
+
+    def start(self):
+        if self.replayer is not None:
+            return
+        try:
+            values = {name: entry.get().strip() for name, entry in self.entries.items()}
+            loops = int(values["loops"] or 1)
+            duration = float(values["duration"]) if values["duration"] else None
+            if loops == 0 and duration is None:
+                self.show("循环重放需要设置最长时间")
+                return
+            self.channel = ChannelPool(values["target"].split(","))
+            self.replayer = Replayer(self.channel, self.calls, float(values["qps"] or 0), int(values["concurrency"] or 1),
+                                     loops, duration, float(values["jitter"] or 0))
+        except Exception as e:
+            self.show(f"参数错误: {e}")
+            return
+        threading.Thread(target=self.replayer.run, daemon=True).start()
+        self.root.after(UI_TICK_MS, self.poll)
+
+    def poll(self):
+        # 在主线程中定时显示进度，线程结束后显示完整的统计
+        report = self.replayer.report
+        if not report.elapsed:
+            if not self.closed:
+                self.show(f"已完成 {len(report)} 次调用")
+            self.root.after(UI_TICK_MS, self.poll)
+            return
+        self.replayer = None
+        self.channel.close()
+        if not self.closed:
+            self.show(report.format())
+
+    def stop(self):
+        if self.replayer is not None:
+            self.replayer.stop()
+
+    def close(self):
+        # 窗口关闭后后台的重放停止，连接在线程结束后关闭
+        self.closed = True
+        self.stop()
+        self.window.destroy()
+
+class ResendDialog:
+    """批量重新发送选中请求的窗口
+
+    每个请求在线程池中发送一次，结果作为新的抓包记录出现在请求列表中，窗口只显示进度。
+    """
+    FIELDS = (("concurrency", "并发数", str(RESEND_WORKERS)), ("timeout", "超时(秒)", str(RESEND_TIMEOUT)))
+
+    def __init__(self, app, calls):
+        self.app = app
+        self.root = app.root
+        self.calls = calls  # [(记录, 请求消息)]
+        self.pending = []
+        self.done = self.errors = self.cancelled = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        self.window = tk.Toplevel(self.root)
+        self.window.title(f"重新发送 {len(calls)} 个请求")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.entries = {}
+        for row, (name, label, default) in enumerate(self.FIELDS):
+            ttk.Label(self.window, text=label).grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            entry = ttk.Entry(self.window)
+            entry.insert(0, default)
+            entry.grid(row=row, column=1, sticky=tk.W + tk.E, padx=5, pady=2)
+            self.entries[name] = entry
+        self.start_button = ttk.Button(self.window, text="开始", command=self.start)
+        self.start_button.grid(row=len(self.FIELDS), column=0, padx=5, pady=5)
+        self.stop_button = ttk.Button(self.window, text="停止", command=self.stop)
+        self.stop_button.grid(row=len(self.FIELDS), column=1, sticky=tk.W, padx=5, pady=5)
+        self.result_text = tk.Text(self.window, height=3, width=50)
+        self.result_text.grid(row=len(self.FIELDS) + 1, column=0, columnspan=2, sticky=tk.W + tk.E, padx=5, pady=5)
+
+    def show(self, content):
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, content)
+
+    def start(self):
+        if self.pending:
+            return
+        try:
+            concurrency = int(self.entries["concurrency"].get().strip() or 1)
+            timeout = float(self.entries["timeout"].get().strip() or 0) or None
+            executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+        except ValueError as e:
+            self.show(f"参数错误: {e}")
+            return
+        self.done = self.errors = self.cancelled = 0
+        self.pending = [executor.submit(self.app.resend, record, request, timeout) for record, request in self.calls]
+        for future in self.pending:
+            future.add_done_callback(self.finished)
+        executor.shutdown(wait=False)
+        self.root.after(UI_TICK_MS, self.poll)
+
+    def finished(self, future):
+        # 在工作线程中调用
+        with self.lock:
+            if future.cancelled():
+                self.cancelled += 1
+                return
+            self.done += 1
+            if future.exception() is not None or future.result()[2]:
+                self.errors += 1
+
+    def poll(self):
+        with self.lock:
+            done, errors, cancelled = self.done, self.errors, self.cancelled
+        if self.closed:
+            return
+        progress = f"已完成 {done}/{len(self.calls)}，出错 {errors}" + (f"，取消 {cancelled}" if cancelled else "")
+        if done + cancelled < len(self.calls):
+            self.show(progress)
+            self.root.after(UI_TICK_MS, self.poll)
+            return
+        self.pending = []
+        self.show(progress + "，结果见请求列表")
+
+    def stop(self):
+        # 还没开始的调用不再发送，正在进行的调用等到完成或超时
+        for future in self.pending:
+            future.cancel()
+
+    def close(self):
+        self.closed = True
+        self.stop()
+        self.window.destroy()
+
+class StatsPanel:
+    """按方法显示调用数、错误数、收发字节和各阶段耗时，以及每个上游连接状态的窗口，定时刷新"""
+    COLUMNS = (("method", "方法", 260), ("calls", "调用", 60), ("errors", "错误", 50), ("bytes_in", "收到字节", 80),
+               ("bytes_out", "返回字节", 80), ("cache", "缓存命中", 80), ("proxy", "代理 p50/p99", 110), ("upstream", "上游 p50/p99", 110),
+               ("hold", "拦截 p50/p99", 110), ("serialize", "序列化 p50/p99", 110))
+    CHANNEL_COLUMNS = (("target", "上游地址", 260), ("outstanding", "进行中", 60), ("health", "状态", 60))
+
+    def __init__(self, root):
+        self.root = root
+        self.closed = False
+        self.window = tk.Toplevel(root)
+        self.window.title("统计")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.tree = ttk.Treeview(self.window, columns=[name for name, _, _ in self.COLUMNS], show="headings")
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, anchor=tk.W if name == "method" else tk.E)
+        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.channel_tree = ttk.Treeview(self.window, columns=[name for name, _, _ in self.CHANNEL_COLUMNS], show="headings",
+                                         height=6)
+        for name, title, width in self.CHANNEL_COLUMNS:
+            self.channel_tree.heading(name, text=title)
+            self.channel_tree.column(name, width=width, anchor=tk.W if name == "target" else tk.E)
+        self.channel_tree.pack(fill=tk.X)
+        self.refresh()
+
+    @staticmethod
+    def format_phase(phase):
+        p50, p99, count = phase
+        if not count:
+            return ""
+        return f"{p50 * 1000:.2f}/{p99 * 1000:.2f}ms"
+
+    def refresh(self):
+        if self.closed:
+            return
+        self.tree.delete(*self.tree.get_children())
+        for path, calls, errors, bytes_in, bytes_out, cache_hits, cache_misses, phases in registry.snapshot():
+            cache = f"{cache_hits}/{cache_hits + cache_misses}" if cache_hits + cache_misses else ""
+            self.tree.insert("", "end", values=(path, calls, errors, bytes_in, bytes_out, cache,
+                                                *(self.format_phase(phases[name]) for name, _, _ in self.COLUMNS[6:])))
+        # 每个地址的多个连接各占一行，连续失败或连接断开的显示为不健康
+        self.channel_tree.delete(*self.channel_tree.get_children())
+        for target, outstanding, healthy in registry.channels():
+            self.channel_tree.insert("", "end", values=(target, outstanding, "健康" if healthy else "不健康"))
+        self.root.after(STATS_REFRESH_MS, self.refresh)
+
+    def close(self):
+        self.closed = True
+        self.window.destroy()
 
-# GUI 应用程序
 class GRPCProxyApp:
     def __init__(self, root):
         self.root = root
@@ -231,6 +561,16 @@ class GRPCProxyApp:
 
         # 初始化一个锁以确保线程安全
         self.lock = threading.Lock()
+        # gRPC 线程提交的界面更新事件，由主线程定时批量处理
+        self.ui_events = collections.deque()
+        # 重新发送在线程池中执行，不阻塞界面
+        self.resend_pool = futures.ThreadPoolExecutor(max_workers=RESEND_WORKERS)
+        self.current_index = None  # 当前显示的记录 id
+        # 选中记录时插入请求框和响应框的文本，用来判断用户是否修改过内容
+        self.shown_request = self.shown_response = ""
+        # gRPC 线程读取的拦截和搜索条件，只在主线程中整体替换
+        self.config = ProxyConfig()
+        self.search_job = None
 
         # 新的顶部行框架
         self.top_row_frame = ttk.Frame(self.root)
@@ -255,15 +595,16 @@ class GRPCProxyApp:
 
         self.intercept_entry = ttk.Entry(self.top_frame)
         self.intercept_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.intercept_entry.bind("<KeyRelease>", self.update_intercept)
 
-        # 请求和响应的数据存储
-        self.requests = []
-        self.responses = []
-        self.pb2s = []
-        self.stubs = []
-        self.request_states = []  # 跟踪每个请求的状态
-        self.original_data = []  # 存储每个请求的原始数据
-        self.displayed_indices = []  # 跟踪显示项目的原始索引
+        # 请求和响应的数据存储，淘汰的记录从列表中移除
+        self.live_store = CaptureStore(on_evict=lambda record: self.ui_events.append(("evict", record.id)))
+        self.store = self.live_store  # 列表当前显示的数据，打开会话后切换为 SessionStore
+        self.session_log = None
+        self.capture_sink = None
+        if CAPTURE_LOG_DIR:
+            session_dir = os.path.join(CAPTURE_LOG_DIR, datetime.now().strftime("session-%Y%m%d-%H%M%S"))
+            self.capture_sink = CaptureSink(CaptureLog(session_dir))
 
         # 左侧框架（用于请求日志）
         self.left_frame = ttk.Frame(self.root)
@@ -280,23 +621,17 @@ class GRPCProxyApp:
         self.clear_button = ttk.Button(self.log_control_frame, text="清除", command=self.clear_request_list)
         self.clear_button.pack(side=tk.LEFT, padx=5)
 
-        # 使用 Treeview 以更好的显示列
-        self.request_list = ttk.Treeview(self.left_frame, columns=("Time", "Servicer", "Method", "Status"), show="headings", selectmode="extended")
-        self.request_list.heading("Time", text="时间")
-        self.request_list.heading("Servicer", text="服务名")
-        self.request_list.heading("Method", text="方法名")
-        self.request_list.heading("Status", text="状态")
-        self.request_list.column("Time", width=140)
-        self.request_list.column("Servicer", width=120)
-        self.request_list.column("Method", width=180)
-        self.request_list.column("Status", width=70)
-        self.request_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.request_list.bind('<<TreeviewSelect>>', self.on_list_select)
-
-        # 为 Treeview 添加垂直滚动条
-        self.scrollbar = ttk.Scrollbar(self.left_frame, orient="vertical", command=self.request_list.yview)
-        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.request_list.configure(yscrollcommand=self.scrollbar.set)
+        # 打开/关闭磁盘上的抓包会话
+        self.session_button = ttk.Button(self.log_control_frame, text="打开会话", command=self.toggle_session)
+        self.session_button.pack(side=tk.LEFT, padx=5)
+
+        # 按方法统计的耗时和流量
+        self.stats_button = ttk.Button(self.log_control_frame, text="统计", command=lambda: StatsPanel(self.root))
+        self.stats_button.pack(side=tk.LEFT, padx=5)
+
+        # 请求列表只创建可见的行
+        self.request_view = VirtualRequestList(self.left_frame, self.store, self.on_list_select)
+        self.request_list = self.request_view.tree
 
         # 右侧框架
         self.right_frame = ttk.Frame(self.root)
@@ -346,26 +681,30 @@ class GRPCProxyApp:
         # 创建右键菜单
         self.menu = tk.Menu(self.root, tearoff=0)
         self.menu.add_command(label="以 JSON 格式复制到剪切板", command=self.copy_to_clipboard)
+        self.menu.add_command(label="重放选中的请求...", command=self.open_replay_dialog)
+        self.menu.add_command(label="重新发送选中的请求...", command=self.open_resend_dialog)
 
         # 绑定右键事件
         self.request_list.bind("<Button-3>", self.show_context_menu)
 
+        self.root.after(UI_TICK_MS, self.drain_ui_events)
+
     def show_context_menu(self, event):
         # 在鼠标位置显示上下文菜单
         self.menu.post(event.x_root, event.y_root)
 
     def copy_to_clipboard(self):
-        selected_items = self.request_list.selection()
         json_data = []
 
-        for item in selected_items:
-            index = self.request_list.index(item)
-            values = self.request_list.item(item, "values")
+        for request_id in self.request_view.selected_ids():
+            record = self.store.get(request_id)
+            if record is None:
+                continue
             json_data.append({
-                "server": values[1],
-                "method": values[2],
-                "request": json.loads(self.requests[index]),
-                "response": json.loads(self.responses[index])
+                "server": record.service.server_name,
+                "method": record.method,
+                "request": self.json_or_text(record.request),
+                "response": self.json_or_text(record.response)
             })
 
         # 转换为 JSON 并使用 tkinter 的剪贴板方法复制
@@ -375,88 +714,253 @@ class GRPCProxyApp:
         self.root.update()  # 保持剪贴板更新
         print("已复制到剪贴板：", json_string)  # 用于调试
 
-    def log_request_arrival(self, servicer_name, method_name, request, pb2, stub):
-        with self.lock:  # 获取锁
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_entry = (current_time, servicer_name, method_name, "")
-            request_json = message_to_dict_str_with_defaults(request)
-            self.requests.append(request_json)
-            self.responses.append("")  # 响应的占位符
-            self.request_states.append({'request_ready': False, 'response_ready': False})
-            self.original_data.append(log_entry)  # 存储原始日志条目
-            self.pb2s.append(pb2)
-            self.stubs.append(stub)
-
-            # 更新列表以包含新请求
-            #self.update_list_based_on_search(None)
-            ex = self.search_entry.get().lower()
-            index = len(self.requests) - 1
-            if re.findall(ex, request_json.lower()) or re.findall(ex, method_name.lower()) or re.findall(ex, servicer_name.lower()):
-                self.request_list.insert("", tk.END, values=(current_time, servicer_name, method_name, ""))
-                self.displayed_indices.append(index)
-            return index
+    def json_or_text(self, content):
+        # 抓包策略省略的内容、错误信息和没有响应的调用不是 JSON，原样复制文本
+        text = self.render(content)
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    def open_replay_dialog(self):
+        records = (self.store.get(request_id) for request_id in self.request_view.selected_ids())
+        calls = calls_from_records(record for record in records if record is not None)
+        if not calls:
+            print("选中的请求不能重放")
+            return
+        ReplayDialog(self.root, calls)
+
+    def open_resend_dialog(self):
+        calls = []
+        for request_id in self.request_view.selected_ids():
+            record = self.store.get(request_id)
+            request = self.resend_request(record) if record is not None else None
+            if request is not None:
+                calls.append((record, request))
+        if not calls:
+            print("选中的请求不能重新发送")
+            return
+        ResendDialog(self, calls)
+
+    @staticmethod
+    def resend_request(record):
+        # 记录中可以重新发送的请求消息，会话中的记录和客户端流返回 None
+        service = record.service
+        if service.stub is None or not service.methods or record.method not in service.methods:
+            return None
+        method = service.methods[record.method]
+        if method.client_streaming:
+            return None
+        try:
+            return method.request_class.FromString(request_payload(record.request, method))
+        except Exception:
+            print(traceback.format_exc())
+            return None
+
+    def resend(self, record, request, timeout=RESEND_TIMEOUT):
+        """在工作线程中重新发送一个请求，返回 (新记录 id, 响应或错误信息, 是否出错)
+
+        每次发送都作为一条新的抓包记录，标记为重新发送并记录发送的耗时。
+        """
+        service = record.service
+        method = service.methods[record.method]
+        # 保留原来的服务名，浏览会话时按服务名找回方法表
+        request_id = self.log_request_arrival(service.server_name, record.method, request, service.methods, service.stub)
+        resent = self.live_store.get(request_id)
+        if resent is not None:
+            resent.resent = True
+        start = time.perf_counter()
+        error = None
+        try:
+            call = getattr(service.stub, record.method)
+            if method.server_streaming:
+                response = RawMessageList()
+                for message in call(request, timeout=timeout):
+                    response.append(RawMessage.of(message))
+            else:
+                response = RawMessage.of(call(request, timeout=timeout))
+        except grpc.RpcError as e:
+            error = f"{e.code().name}: {e.details()}"
+        except Exception as e:
+            print(traceback.format_exc())
+            error = str(e)
+        if resent is not None:
+            resent.elapsed = time.perf_counter() - start
+        if error is not None:
+            self.highlight_error(request_id, error)
+            return request_id, error, True
+        self.log_response(request_id, response)
+        self.update_status(request_id, "成功")
+        return request_id, response, False
+
+    def log_request_arrival(self, servicer_name, method_name, request, methods, stub):
+        # 在 gRPC 线程中调用，只记录数据，列表由主线程批量插入
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # 只保存序列化后的消息和类型，展示、导出或搜索时再解码
+        if not isinstance(request, (str, RawMessage, RawMessageList)):
+            request = RawMessage.of(request)
+        record = self.live_store.add(self.live_store.service(servicer_name, methods, stub), method_name, request, current_time)
+        self.ui_events.append(("insert", record.id))
+        return record.id
 
     def log_response(self, request_id, response):
-        response_json = message_to_dict_str_with_defaults(response)
-        self.responses[request_id] = response_json
+        if not isinstance(response, (str, RawMessage, RawMessageList)):
+            response = RawMessage.of(response)
+        record = self.live_store.get(request_id)
+        if record is not None:
+            self.live_store.set_response(record, response)
+
+    def set_request(self, request_id, content):
+        record = self.live_store.get(request_id)
+        if record is not None:
+            self.live_store.set_request(record, content)
+
+    def render(self, content):
+        # 把存储的内容转换为界面显示的字符串，原始字节在这里才解码
+        if isinstance(content, RawMessage):
+            return render_message(content)
+        if isinstance(content, RawMessageList):
+            # 流式调用的内容还在增长，不做缓存
+            return content.to_json()
+        return content
 
     def update_status(self, request_id, status):
-        # 更新 original_data 中的状态
-        servicer_name, current_time, method_name, _ = self.original_data[request_id]
-        self.original_data[request_id] = (servicer_name, current_time, method_name, status)
-
-        # 如果项目当前显示，则更新显示的列表
-        if request_id in self.displayed_indices:
-            displayed_index = self.displayed_indices.index(request_id)
-            item_id = self.request_list.get_children()[displayed_index]
-            self.request_list.item(item_id, values=(servicer_name, current_time, method_name, status))
+        # 只更新记录，列表由主线程批量刷新；记录已被淘汰或清除时忽略
+        record = self.live_store.get(request_id)
+        if record is None or record.status == status:
+            return
+        record.status = status
+        self.ui_events.append(("status", request_id))
+        if self.capture_sink is not None and status in ("成功", "出错"):
+            # 调用完成后追加到磁盘上的抓包日志
+            self.capture_sink.submit(*encode_record(record))
 
     def highlight_error(self, request_id, error_message):
-        # 检查 request_id 是否有效
-        if request_id < len(self.original_data):
-            item_id = self.request_list.get_children()[request_id]
-            self.request_list.tag_configure('error', background='yellow', foreground='red')
-            self.request_list.item(item_id, tags=('error',))
+        record = self.live_store.get(request_id)
+        if record is not None:
+            self.live_store.set_error(record, error_message)
             self.update_status(request_id, "出错")
-            self.responses[request_id] = error_message
-            self.set_response_content(request_id, error_message)
-        else:
-            print(f"错误: 无效的 request_id {request_id} 用于高亮错误")
+            self.ui_events.append(("error", request_id))
+
+    def show_response(self, request_id, content):
+        # gRPC 线程中调用，如果该请求正在显示则由主线程更新响应框
+        self.ui_events.append(("response", request_id, content))
+
+    def drain_ui_events(self):
+        try:
+            self.apply_ui_events()
+        except Exception:
+            print(traceback.format_exc())
+        self.root.after(UI_TICK_MS, self.drain_ui_events)
+
+    def apply_ui_events(self):
+        # 在主线程中批量处理界面更新：合并同一请求的多次状态变化，插入的新请求只编译一次搜索条件
+        inserts, updated, errors, evicted, responses = [], set(), set(), set(), {}
+        events = self.ui_events
+        if self.store is not self.live_store:
+            # 浏览会话时丢弃实时更新，返回实时列表时会重新生成
+            events.clear()
+            return
+        for _ in range(min(len(events), UI_BATCH_LIMIT)):
+            event = events.popleft()
+            kind, request_id = event[0], event[1]
+            if kind == "evict":
+                evicted.add(request_id)
+            elif self.store.get(request_id) is None:
+                continue  # 记录已被淘汰或清除
+            elif kind == "insert":
+                inserts.append(request_id)
+            elif kind == "status":
+                updated.add(request_id)
+            elif kind == "error":
+                errors.add(request_id)
+            elif kind == "response":
+                responses[request_id] = event[2]
+
+        if evicted:
+            self.request_view.remove(evicted)
+            if self.current_index in evicted:
+                self.current_index = None
+
+        query = self.config.search
+        if inserts:
+            for request_id in inserts:
+                record = self.store.get(request_id)
+                if record is not None and query.matches(record, self.store, self.render):
+                    self.request_view.insert(request_id)
+
+        if updated or errors:
+            view = self.request_view
+            for request_id in updated | errors:
+                record = self.store.get(request_id)
+                if record is None:
+                    continue
+                if query.dynamic:
+                    # 状态或响应变化后重新判断是否满足搜索条件
+                    matched = query.matches(record, self.store, self.render)
+                    shown = request_id in view
+                    if shown and not matched:
+                        view.remove((request_id,))
+                        continue
+                    if not shown and matched:
+                        view.insert(request_id)
+                        continue
+                view.update(record)
+            if self.current_index in updated | errors:
+                self.refresh_current(self.store.get(self.current_index))
+
+        for request_id, content in responses.items():
+            if request_id == self.current_index:
+                self.set_response_content(request_id, self.render(content))
+        self.request_view.refresh()
+
+    def refresh_current(self, record):
+        # 正在显示的记录状态或响应变化后更新按钮和内容框，用户已经修改过的内容框保持不变
+        if record is None:
+            return
+        self.update_buttons(record)
+        if self.get_request_content(record.id) == self.shown_request:
+            self.set_request_content(record.id, self.render(record.request))
+        if self.get_response_content(record.id) == self.shown_response:
+            self.set_response_content(record.id, self.render(record.response))
+
+    def update_buttons(self, record):
+        self.independent_send_button.pack_forget()
+        self.request_button.pack_forget()
+        self.default_content_button.pack_forget()
+        self.response_button.pack_forget()
+        # 客户端流的请求不能重新发送，只有被拦截的调用才能放行
+        if record.status == "成功" and not isinstance(record.request, RawMessageList):
+            self.independent_send_button.pack(side=tk.BOTTOM, padx=5, pady=5) 
+        elif record.status == "" and record.held is not None:
+            self.request_button.pack(side=tk.BOTTOM, padx=5, pady=5)
+            self.default_content_button.pack(side=tk.BOTTOM, padx=5, pady=5)
+            self.response_button.pack(side=tk.BOTTOM, padx=5, pady=5)
 
     def on_list_select(self, event):
-        selected_item = self.request_list.selection()
-        if len(selected_item) == 1:
+        selected_ids = self.request_view.selected_ids()
+        record = self.store.get(selected_ids[0]) if len(selected_ids) == 1 else None
+        if record is not None:
             # 切换之前保存当前内容
-            displayed_index = self.request_list.index(selected_item[0])
-            if hasattr(self, 'current_index') and self.current_index is not None:
-                self.requests[self.current_index] = self.get_request_content(self.current_index)
-                self.responses[self.current_index] = self.get_response_content(self.current_index)
-            selected_values = self.request_list.item(selected_item)["values"]
-            print(selected_values[2],selected_values[2] not in BIDISTREAM_METHODS)
-            self.independent_send_button.pack_forget()
-            self.request_button.pack_forget()
-            self.default_content_button.pack_forget()
-            self.response_button.pack_forget()
-            if selected_values[3] == "成功" and selected_values[2] not in BIDISTREAM_METHODS:
-                self.independent_send_button.pack(side=tk.BOTTOM, padx=5, pady=5) 
-            elif selected_values[3] == "" and selected_values[2] not in BIDISTREAM_METHODS:
-                self.request_button.pack(side=tk.BOTTOM, padx=5, pady=5)
-                self.default_content_button.pack(side=tk.BOTTOM, padx=5, pady=5)
-                self.response_button.pack(side=tk.BOTTOM, padx=5, pady=5)
-                
-            # 使用显示的索引更新当前索引
-            
-            if displayed_index < len(self.displayed_indices):
-                self.current_index = self.displayed_indices[displayed_index]
-
-                # 检索并设置新选择项的内容
-                request_content = self.requests[self.current_index]
-                response_content = self.responses[self.current_index]
-
-                self.set_request_content(self.current_index, request_content)
-                self.set_response_content(self.current_index, response_content)
-            else:
-                print("错误: 显示索引超出范围")  # 调试
+            current = self.store.get(self.current_index)
+            if current is not None:
+                # 只有用户修改过显示的内容才保存为文本，未修改的仍保留原始消息；
+                # 与插入内容框时的文本比较，记录在显示之后收到的响应不会被旧的文本覆盖
+                request_content = self.get_request_content(self.current_index)
+                if request_content != self.shown_request:
+                    self.store.set_request(current, request_content)
+                response_content = self.get_response_content(self.current_index)
+                if response_content != self.shown_response:
+                    self.store.set_response(current, response_content)
+            self.update_buttons(record)
+            self.current_index = record.id
+
+            # 检索并设置新选择项的内容
+            request_content = self.render(record.request)
+            response_content = self.render(record.response)
+
+            self.set_request_content(self.current_index, request_content)
+            self.set_response_content(self.current_index, response_content)
         else:
             self.set_request_content(None, "")
             self.set_response_content(None, "")
@@ -469,131 +973,194 @@ class GRPCProxyApp:
         self.request_text.delete(1.0, tk.END)
         if request_id is not None:
             self.request_text.insert(tk.END, content)
+        self.shown_request = self.get_request_content(request_id)
 
     def get_request_content(self, request_id):
         # 从 UI 检索修改后的请求内容
         content = self.request_text.get(1.0, tk.END).strip()
         return content
 
+    def hold(self, request_id):
+        # 只有被拦截的请求才创建 HeldCall，记录已被淘汰时直接放行
+        record = self.live_store.get(request_id)
+        if record is None:
+            held = HeldCall()
+            held.abandon()
+            return held
+        if record.held is None:
+            record.held = HeldCall()
+        return record.held
+
     def wait_for_request_release(self, request_id):
-        while not self.request_states[request_id]['request_ready']:
-            self.root.update()
+        # 在 gRPC 线程中阻塞等待界面放行，返回 (操作, 请求内容)
+        # 超时按 HOLD_TIMEOUT_ACTION 处理，内容为 None 表示使用原始请求
+        try:
+            return self.hold(request_id).request_future.result(timeout=HOLD_TIMEOUT)
+        except futures.TimeoutError:
+            return HOLD_TIMEOUT_ACTION, None
+
+    def selected_held_call(self):
+        selected_ids = self.request_view.selected_ids()
+        if not selected_ids:
+            return None, None
+        record = self.store.get(selected_ids[0])
+        if record is None or record.held is None:
+            print("选中的请求未被拦截")
+            return None, None
+        return record.id, record.held
 
     def release_request(self, type):
-        selected_item = self.request_list.selection()
-        if selected_item:
-            index = self.request_list.index(selected_item[0])
-            self.request_states[index]['request_ready'] = type
+        index, held = self.selected_held_call()
+        if held is not None:
+            held.release_request(type, self.get_request_content(index))
 
     def set_response_content(self, request_id, content):
         self.response_text.delete(1.0, tk.END)
         if request_id is not None:
             self.response_text.insert(tk.END, content)
-
-    def match_search(self, method):
-        search_pattern = self.search_entry.get()
-        return method.lower().find(search_pattern.lower()) != -1
+        self.shown_response = self.get_response_content(request_id)
 
     def get_response_content(self, request_id):
         return self.response_text.get(1.0, tk.END).strip()
 
     def wait_for_response_release(self, request_id):
-        while not self.request_states[request_id]['response_ready']:
-            self.root.update()
+        # 返回界面放行时的响应内容，超时返回 None 表示使用原始响应
+        try:
+            return self.hold(request_id).response_future.result(timeout=HOLD_TIMEOUT)
+        except futures.TimeoutError:
+            return None
 
     def release_response(self):
-        selected_item = self.request_list.selection()
-        if selected_item:
-            index = self.request_list.index(selected_item[0])
-            self.request_states[index]['response_ready'] = True
+        index, held = self.selected_held_call()
+        if held is not None:
+            held.release_response(self.get_response_content(index))
 
     def update_list_based_on_search(self, event):
-        search_pattern = self.search_entry.get().lower()
-        try:
-            regex = re.compile(search_pattern)
-        except re.error:
-            return  # 无效的正则表达式，不执行任何操作
-        with self.lock:
-            # 清空当前列表并重置显示的索引
-            for item in self.request_list.get_children():
-                self.request_list.delete(item)
-            self.displayed_indices.clear()
-
-            # 重新填充列表以包含过滤后的项目
-            for i, (request_json, response_json) in enumerate(zip(self.requests, self.responses)):
-                current_time, servicer_name, method_name, status = self.original_data[i]
-                if regex.search(request_json.lower()) or regex.search(response_json.lower()) or regex.search(method_name.lower()) or regex.search(servicer_name.lower()):
-                    self.request_list.insert("", tk.END, values=(current_time, servicer_name, method_name, status))
-                    self.displayed_indices.append(i)  # 跟踪原始索引
+        # 输入时防抖，停止输入一段时间后再过滤
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DEBOUNCE_MS, self.refresh_list, False)
+
+    def refresh_list(self, full=True):
+        # 按搜索条件过滤列表；新条件比旧条件更严格时只检查列表中已有的记录
+        self.search_job = None
+        query = SearchQuery(self.search_entry.get())
+        self.request_view.store = self.store
+        if not query.terms:
+            ids = self.store.record_ids()  # 没有条件时不需要读取记录
+        else:
+            if not full and query.refines(self.config.search):
+                candidates = (self.store.get(request_id) for request_id in self.request_view.ids)
+            else:
+                candidates = iter(self.store)
+            ids = [record.id for record in candidates if record is not None and query.matches(record, self.store, self.render)]
+        self.config = self.config.with_search(query)
+        self.request_view.set_ids(ids)
+        if self.current_index is not None and self.current_index not in self.request_view:
             self.current_index = None
 
+    def update_intercept(self, event=None):
+        # 拦截条件变化时生成新的配置快照，正在进行的调用继续使用旧的快照
+        text = self.intercept_entry.get().strip()
+        if text != self.config.intercept_text:
+            self.config = ProxyConfig(text, self.config.search)
+
     def should_intercept(self, method_name):
-        intercept_pattern = self.intercept_entry.get().strip().lower()
-        # 如果拦截模式为空，则不拦截
-        if not intercept_pattern:
-            return False
-        return (intercept_pattern in method_name.lower() and method_name not in BIDISTREAM_METHODS)
+        # 在 gRPC 线程中调用，拦截条件为空时不拦截
+        return self.config.should_intercept(method_name)
 
     def clear_request_list(self):
-        # 清空请求列表
+        # 清空实时请求列表，正在浏览会话时先返回实时列表
+        if self.store is not self.live_store:
+            self.close_session()
         with self.lock:
-            for item in self.request_list.get_children():
-                self.request_list.delete(item)
+            self.request_view.clear()
             self.current_index = None
-            # 清空相关数据结构
-            self.requests.clear()
-            self.responses.clear()
-            self.pb2s.clear()
-            self.stubs.clear()
-            self.request_states.clear()
-            self.original_data.clear()
-            self.displayed_indices.clear()
+            # 清空相关数据结构，仍被拦截的调用直接放行
+            self.live_store.clear()
+            render_message.cache_clear()
 
             # 清空请求和响应内容文本框
             self.set_request_content(None, "")
             self.set_response_content(None, "")
 
+    def toggle_session(self):
+        if self.store is self.live_store:
+            directory = filedialog.askdirectory(title="打开抓包会话")
+            if directory:
+                self.open_session(directory)
+        else:
+            self.close_session()
+
+    def open_session(self, directory):
+        # 浏览磁盘上的抓包会话，只建立偏移索引，不把记录载入内存
+        if self.session_log is not None:
+            self.session_log.close()
+        self.session_log = CaptureLog(directory)
+        self.store = SessionStore(self.session_log)
+        self.session_button.config(text="关闭会话")
+        self.current_index = None
+        self.refresh_list()
+        self.set_request_content(None, "")
+        self.set_response_content(None, "")
+
+    def close_session(self):
+        if self.session_log is not None:
+            self.session_log.close()
+            self.session_log = None
+        self.store = self.live_store
+        self.session_button.config(text="打开会话")
+        self.current_index = None
+        self.refresh_list()
+        self.set_request_content(None, "")
+        self.set_response_content(None, "")
+
     def add_request(self, request_json, response_json, current_time, servicer_name, method_name, status):
         # 添加新的请求和响应数据
-        self.requests.append(request_json)
-        self.responses.append(response_json)
-        self.original_data.append((current_time, servicer_name, method_name, status))
-        self.request_states.append({'request_ready': False, 'response_ready': False})
-
-        # 在 Treeview 的末尾插入新项目
-        item_id = self.request_list.insert("", tk.END, values=(current_time, servicer_name, method_name, status))
-        self.displayed_indices.append(len(self.requests) - 1)
-        return item_id
-
-    def update_request_status(self, item_id, new_status):
-        # 更新 Treeview 中特定项目的状态
-        current_values = self.request_list.item(item_id, 'values')
-        new_values = current_values[:-1] + (new_status,)
-        self.request_list.item(item_id, values=new_values)
+        record = self.live_store.add(self.live_store.service(servicer_name, None, None), method_name, request_json, current_time)
+        self.live_store.set_response(record, response_json)
+        record.status = status
+
+        # 追加到列表末尾
+        self.request_view.insert(record.id)
+        self.request_view.refresh()
+        return record.id
+
+    def update_request_status(self, request_id, new_status):
+        # 更新列表中特定记录的状态
+        record = self.live_store.get(request_id)
+        if record is not None:
+            record.status = new_status
+            self.request_view.update(record)
 
     def independent_send(self):
+        # 用请求框中修改后的内容重新发送，在线程池中执行，不阻塞界面
+        record = self.store.get(self.current_index)
+        if record is None:
+            return
+        if record.service.stub is None:
+            print("会话中的记录不能重新发送")
+            return
         try:
-            # 从请求列表中选定项获取当前方法名
-            current_method = self.request_list.item(self.request_list.selection()[0], 'values')[2]
-            self.set_response_content(self.current_index, "")
-            # 检索正确的 pb2 模块和请求体名称
-            pb2 = self.pb2s[self.current_index]
-            request_proto = get_real_body_name(pb2, current_method, "Request")()
-            
             # 将修改后的请求 JSON 解析为请求 proto
-            modified_request_json = self.get_request_content(self.current_index)
-            modified_request_dict = json.loads(modified_request_json)
-            modified_request = ParseDict(modified_request_dict, request_proto)
-
-            # 动态调用存根上的方法
-            response = getattr(self.stubs[self.current_index], current_method)(modified_request)
-
-            # 更新数据结构中的响应内容
-            response_json = message_to_dict_str_with_defaults(response)
-            self.set_response_content(self.current_index, response_json)
+            request_class = record.service.methods[record.method].request_class
+            request = dict_to_message(json.loads(self.get_request_content(self.current_index)), request_class())
+        except Exception:
+            print(traceback.format_exc())
+            return
+        self.set_response_content(self.current_index, "")
+        # 完成后如果仍在显示这条记录，把结果显示在响应框中
+        future = self.resend_pool.submit(self.resend, record, request)
+        future.add_done_callback(lambda f, request_id=record.id: self.show_resend_result(request_id, f))
+
+    def show_resend_result(self, request_id, future):
+        # 在工作线程中调用，resend 本身出错时显示异常信息
+        try:
+            content = future.result()[1]
         except Exception as e:
-            logging.error(f"独立发送中的错误: {e}")
-            logging.error(traceback.format_exc())
+            print(traceback.format_exc())
+            content = str(e)
+        self.ui_events.append(("response", request_id, content))
 
 
 import proto.example_pb2 as example_pb2
@@ -601,27 +1168,86 @@ import proto.example_pb2_grpc as example_pb2_grpc
 
 class ProxyExample(example_pb2_grpc.ExampleServiceServicer, BaseServicer):
     def __init__(self, gui, channel):
-        BaseServicer.__init__(self, gui)
+        BaseServicer.__init__(self, gui, example_pb2.DESCRIPTOR.services_by_name["ExampleService"])
         self.stub = example_pb2_grpc.ExampleServiceStub(channel)
-        self.pb2 = example_pb2
         self.server_name = "example_server"
 
-def start_demo_server(gui):
+def start_demo_server(gui, upstream=("localhost:50051",), port=50052, channels_per_target=CHANNELS_PER_TARGET,
+                      policy=LB_POLICY, cache=None, rules=None):
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=100), interceptors=[LoggingInterceptor(gui, "config_server")])
-    client_channel = grpc.insecure_channel('localhost:50051')
-    example_pb2_grpc.add_ExampleServiceServicer_to_server(ProxyExample(gui, client_channel), server)
-    server.add_insecure_port('[::]:50052')
+    client_channel = ChannelPool(upstream, channels_per_target, policy)
+    registry.add_pool(client_channel)
+    servicer = ProxyExample(gui, client_channel)
+    servicer.cache = cache
+    servicer.rules = rules
+    if PASSTHROUGH:
+        server.add_generic_rpc_handlers((PassthroughHandler(servicer, client_channel),))
+    else:
+        server.add_generic_rpc_handlers((servicer.rpc_handler(),))
+    server.add_insecure_port(f'[::]:{port}')
     server.start()
-    print("代理服务器已在端口 50052 启动")
+    print(f"代理服务器已在端口 {port} 启动")
     server.wait_for_termination()
-    
+
+async def serve_aio_demo(gui, upstream=("localhost:50051",), port=50052, channels_per_target=CHANNELS_PER_TARGET,
+                         policy=LB_POLICY, cache=None, rules=None):
+    # aio 服务端不支持同步拦截器，未注册的方法默认返回 UNIMPLEMENTED
+    server = grpc.aio.server()
+    client_channel = ChannelPool(upstream, channels_per_target, policy, aio=True)
+    registry.add_pool(client_channel)
+    # 界面上的“重新发送”在线程池中同步调用，仍然使用同步通道
+    servicer = ProxyExample(gui, ChannelPool(upstream, 1, policy))
+    servicer.cache = cache
+    servicer.rules = rules
+    server.add_generic_rpc_handlers((AioProxyHandler(servicer, client_channel),))
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f"代理服务器(aio)已在端口 {port} 启动")
+    await server.wait_for_termination()
+
+def start_aio_demo_server(gui, upstream=("localhost:50051",), port=50052, channels_per_target=CHANNELS_PER_TARGET,
+                          policy=LB_POLICY, cache=None, rules=None):
+    asyncio.run(serve_aio_demo(gui, upstream, port, channels_per_target, policy, cache, rules))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="gRPC 抓包代理")
+    parser.add_argument("-d", "--descriptor-set", action="append", default=[],
+                        help="protoc --descriptor_set_out 生成的描述文件或包含描述文件的目录，可重复指定；不指定时运行 demo")
+    parser.add_argument("-u", "--upstream", default="localhost:50051", help="转发的目标地址，多个后端用逗号分隔")
+    parser.add_argument("--reflection", action="store_true", help="通过第一个后端的 gRPC 反射接口读取服务描述，可以和 -d 一起使用")
+    parser.add_argument("-p", "--port", type=int, default=50052, help="代理监听的端口")
+    parser.add_argument("--channels", type=int, default=CHANNELS_PER_TARGET, help="每个后端地址建立的连接数")
+    parser.add_argument("--lb", choices=("round_robin", "least_outstanding"), default=LB_POLICY, help="在多个连接间选择的策略")
+    parser.add_argument("--cache-dir", default=DESCRIPTOR_CACHE_DIR, help="描述集缓存目录，设为空字符串不缓存")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="提供 Prometheus 指标的 HTTP 端口")
+    parser.add_argument("--cache", action="append", default=[], metavar="方法正则=秒数",
+                        help="缓存匹配方法的一元调用响应，可重复指定")
+    parser.add_argument("--rules", help="自动改写、mock 和注入错误的规则文件（JSON），修改后自动重新加载")
+    parser.add_argument("--capture-policy", help="按方法抽样、只记录元数据、限制消息大小或只记录出错和慢调用的策略文件（JSON）")
+    return parser.parse_args()
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    cache = ResponseCache(parse_cache_rules(args.cache)) if args.cache else None
+    rules = RuleSet(args.rules) if args.rules else None
     root = tk.Tk()
     app = GRPCProxyApp(root)
+    # 代理引擎通过 recorder 记录调用，配置了抓包策略时按策略过滤
+    recorder = CaptureRouter(app, load_capture_policies(args.capture_policy)) if args.capture_policy else app
 
     # 在单独的线程中启动 gRPC 服务器
     import threading
-    server_thread = threading.Thread(target=start_demo_server, args=(app,))
+    upstream = args.upstream.split(",")
+    if args.descriptor_set or args.reflection:
+        service_descriptors = load_services(args.descriptor_set, args.cache_dir or None,
+                                            reflection=upstream[0] if args.reflection else None)
+        server_thread = threading.Thread(target=start_aio_generic_server if USE_AIO else start_generic_server,
+                                         args=(recorder, service_descriptors, upstream, args.port, args.channels, args.lb, cache, rules))
+    else:
+        server_thread = threading.Thread(target=start_aio_demo_server if USE_AIO else start_demo_server,
+                                         args=(recorder, upstream, args.port, args.channels, args.lb, cache, rules))
     server_thread.daemon = True
     server_thread.start()
     root.mainloop()
\ No newline at end of file
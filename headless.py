@@ -0,0 +1,139 @@
+import os
+import re
+import argparse
+from datetime import datetime
+from capture_log import CaptureLog, CaptureSink
+from descriptor_sets import load_services, DESCRIPTOR_CACHE_DIR
+from channel_pool import CHANNELS_PER_TARGET, LB_POLICY
+from metrics import start_metrics_server, METRICS_PORT
+from response_cache import ResponseCache, parse_cache_rules
+from rules import RuleSet
+from capture_policy import CaptureRouter, load_capture_policies
+from proxy_engine import (HeldCall, CaptureStore, RawMessage, RawMessageList, encode_record,
+                          start_generic_server, start_aio_generic_server)
+
+# 无界面模式默认的抓包输出目录，每次启动在其中新建一个会话
+HEADLESS_OUTPUT_DIR = "captures"
+
+
+class HeadlessRecorder:
+    """不依赖 tkinter 的抓包记录器，实现与界面相同的回调接口
+
+    改写和 mock 由代理引擎按规则完成；方法名匹配 intercept 正则的调用仍然经过拦截流程，
+    但立即原样放行，不等待人工操作。调用完成后记录交给 sink 写入磁盘，随后从内存中移除，
+    长时间运行时内存只保存进行中的调用。
+    """
+    def __init__(self, sink=None, intercept=None):
+        self.store = CaptureStore()
+        self.sink = sink
+        self.intercept = re.compile(intercept, re.IGNORECASE) if intercept else None
+
+    def log_request_arrival(self, servicer_name, method_name, request, methods, stub):
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not isinstance(request, (str, RawMessage, RawMessageList)):
+            request = RawMessage.of(request)
+        return self.store.add(self.store.service(servicer_name, methods, stub), method_name, request, current_time).id
+
+    def log_response(self, request_id, response):
+        if not isinstance(response, (str, RawMessage, RawMessageList)):
+            response = RawMessage.of(response)
+        record = self.store.get(request_id)
+        if record is not None:
+            self.store.set_response(record, response)
+
+    def set_request(self, request_id, content):
+        record = self.store.get(request_id)
+        if record is not None:
+            self.store.set_request(record, content)
+
+    def update_status(self, request_id, status):
+        record = self.store.get(request_id)
+        if record is None or record.status == status:
+            return
+        record.status = status
+        if status in ("成功", "出错"):
+            if self.sink is not None:
+                self.sink.submit(*encode_record(record))
+            self.store.remove(request_id)
+
+    def highlight_error(self, request_id, error_message):
+        record = self.store.get(request_id)
+        if record is not None:
+            self.store.set_error(record, error_message)
+            self.update_status(request_id, "出错")
+
+    def should_intercept(self, method_name):
+        return self.intercept is not None and self.intercept.search(method_name) is not None
+
+    def hold(self, request_id):
+        # 立即放行原始请求，响应在 show_response 中放行
+        record = self.store.get(request_id)
+        if record is None:
+            held = HeldCall()
+            held.abandon()
+            return held
+        if record.held is None:
+            record.held = HeldCall()
+            record.held.release_request("transfer", None)
+        return record.held
+
+    def wait_for_request_release(self, request_id):
+        return self.hold(request_id).request_future.result()
+
+    def show_response(self, request_id, content):
+        # 放行 None，使用上游返回的原始响应
+        self.hold(request_id).release_response(None)
+
+    def wait_for_response_release(self, request_id):
+        return self.hold(request_id).response_future.result()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="无界面的 gRPC 代理，把抓包记录写入磁盘")
+    parser.add_argument("-d", "--descriptor-set", action="append", default=[],
+                        help="protoc --descriptor_set_out 生成的描述文件或目录，可重复指定")
+    parser.add_argument("-u", "--upstream", default="localhost:50051", help="被代理的服务地址，多个地址用逗号分隔")
+    parser.add_argument("--reflection", action="store_true", help="通过第一个服务地址的 gRPC 反射接口读取服务描述，可以和 -d 一起使用")
+    parser.add_argument("-p", "--port", type=int, default=50052, help="代理监听的端口")
+    parser.add_argument("--channels", type=int, default=CHANNELS_PER_TARGET, help="每个服务地址建立的连接数")
+    parser.add_argument("--lb", choices=("round_robin", "least_outstanding"), default=LB_POLICY, help="选择连接的策略")
+    parser.add_argument("-o", "--output", default=HEADLESS_OUTPUT_DIR, help="抓包日志目录，每次启动新建一个会话")
+    parser.add_argument("--rules", help="自动改写、mock 和注入错误的规则文件（JSON），修改后自动重新加载")
+    parser.add_argument("--capture-policy", help="按方法抽样、只记录元数据、限制消息大小或只记录出错和慢调用的策略文件（JSON）")
+    parser.add_argument("--intercept", help="方法名匹配该正则的调用经过拦截流程并立即放行，用于测量拦截流程的开销")
+    parser.add_argument("--aio", action="store_true", help="使用基于 grpc.aio 的代理引擎")
+    parser.add_argument("--cache-dir", default=DESCRIPTOR_CACHE_DIR, help="描述集缓存目录，传入空字符串表示不缓存")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="提供 Prometheus 指标的 HTTP 端口")
+    parser.add_argument("--cache", action="append", default=[], metavar="方法正则=秒数",
+                        help="缓存匹配方法的一元调用响应，可重复指定")
+    args = parser.parse_args(argv)
+    if not args.descriptor_set and not args.reflection:
+        parser.error("需要 -d 指定描述文件或使用 --reflection")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    session_dir = os.path.join(args.output, datetime.now().strftime("session-%Y%m%d-%H%M%S"))
+    sink = CaptureSink(CaptureLog(session_dir))
+    recorder = HeadlessRecorder(sink, args.intercept)
+    rules = RuleSet(args.rules) if args.rules else None
+    if args.capture_policy:
+        recorder = CaptureRouter(recorder, load_capture_policies(args.capture_policy))
+    upstream = args.upstream.split(",")
+    services = load_services(args.descriptor_set, args.cache_dir or None, reflection=upstream[0] if args.reflection else None)
+    cache = ResponseCache(parse_cache_rules(args.cache)) if args.cache else None
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    print(f"抓包日志写入 {session_dir}")
+    start_server = start_aio_generic_server if args.aio else start_generic_server
+    try:
+        start_server(recorder, services, upstream, args.port, args.channels, args.lb, cache, rules)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import time
+import bisect
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus 文本格式指标的 HTTP 端口，None 表示不启动
+METRICS_PORT = None
+# 耗时直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 每次调用分别统计的耗时：代理自身处理、等待上游、拦截等待放行、消息序列化和解析
+PHASES = ("proxy", "upstream", "hold", "serialize")
+# 导出的计数器：(指标名, MethodMetrics 的属性, 说明)
+COUNTERS = (
+    ("grpc_proxy_calls_total", "calls", "Completed calls."),
+    ("grpc_proxy_errors_total", "errors", "Failed calls."),
+    ("grpc_proxy_received_bytes_total", "bytes_in", "Request bytes received from clients."),
+    ("grpc_proxy_sent_bytes_total", "bytes_out", "Response bytes sent to clients."),
+    ("grpc_proxy_cache_hits_total", "cache_hits", "Calls answered from the response cache."),
+    ("grpc_proxy_cache_misses_total", "cache_misses", "Cacheable calls forwarded upstream."),
+)
+
+
+class Histogram:
+    """按 LATENCY_BUCKETS 分桶的耗时分布"""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # 最后一个桶是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """按桶内线性插值估算分位数，与 Prometheus 的 histogram_quantile 相同"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                return lower + (LATENCY_BUCKETS[index] - lower) * (rank - seen) / count
+            seen += count
+        return LATENCY_BUCKETS[-1]
+
+
+class MethodMetrics:
+    """一个方法的调用数、错误数、收发字节数和各阶段耗时"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0    # 从客户端收到的请求字节
+        self.bytes_out = 0   # 返回给客户端的响应字节
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def finish(self, durations, error, bytes_in, bytes_out):
+        with self.lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            for phase, duration in durations.items():
+                self.phases[phase].observe(duration)
+
+    def cache_lookup(self, hit):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def serialized(self, duration, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.phases["serialize"].observe(duration)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def timed_parser(self, parse, incoming=False):
+        # 包装 FromString，incoming 为 True 时计入从客户端收到的字节
+        def parse_timed(data):
+            start = time.perf_counter()
+            message = parse(data)
+            self.serialized(time.perf_counter() - start, len(data) if incoming else 0)
+            return message
+        return parse_timed
+
+    def timed_serializer(self, serialize, outgoing=False):
+        # 包装 SerializeToString，outgoing 为 True 时计入返回给客户端的字节
+        def serialize_timed(message):
+            start = time.perf_counter()
+            data = serialize(message)
+            self.serialized(time.perf_counter() - start, 0, len(data) if outgoing else 0)
+            return data
+        return serialize_timed
+
+
+class CallTimer:
+    """一次调用的计时器
+
+    调用开始时处于 proxy 阶段，switch 切换到另一个阶段并把经过的时间计入之前的阶段，
+    finish 时每个用到的阶段各记录一次。只调用一次 finish，之后的调用被忽略。
+    """
+    __slots__ = ("metrics", "phase", "last", "durations", "bytes_in", "bytes_out", "finished")
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.phase = "proxy"
+        self.last = time.perf_counter()
+        self.durations = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.finished = False
+
+    def switch(self, phase):
+        now = time.perf_counter()
+        self.durations[self.phase] = self.durations.get(self.phase, 0.0) + now - self.last
+        self.phase = phase
+        self.last = now
+
+    def finish(self, error=False):
+        if self.finished:
+            return
+        self.finished = True
+        self.switch(None)
+        self.metrics.finish(self.durations, error, self.bytes_in, self.bytes_out)
+
+
+class Metrics:
+    """按方法路径汇总的指标"""
+    def __init__(self):
+        self.methods = {}
+        self.pools = []     # 代理转发用的上游连接池，统计窗口显示每个连接的状态
+        self.lock = threading.Lock()
+
+    def method(self, path):
+        metrics = self.methods.get(path)
+        if metrics is None:
+            with self.lock:
+                metrics = self.methods.setdefault(path, MethodMetrics(path))
+        return metrics
+
+    def timer(self, path):
+        return CallTimer(self.method(path))
+
+    def add_pool(self, pool):
+        with self.lock:
+            self.pools.append(pool)
+
+    def channels(self):
+        """全部上游连接的 (地址, 进行中的调用数, 是否健康)"""
+        return [row for pool in list(self.pools) for row in pool.stats()]
+
+    def snapshot(self):
+        """每个方法的 (路径, 调用数, 错误数, 收到字节, 返回字节, 缓存命中数, 缓存未命中数, {阶段: (p50, p99, 次数)})"""
+        rows = []
+        for path, metrics in sorted(list(self.methods.items())):
+            with metrics.lock:
+                phases = {phase: (histogram.quantile(0.5), histogram.quantile(0.99), histogram.count)
+                          for phase, histogram in metrics.phases.items()}
+                rows.append((path, metrics.calls, metrics.errors, metrics.bytes_in, metrics.bytes_out,
+                             metrics.cache_hits, metrics.cache_misses, phases))
+        return rows
+
+    def render(self):
+        """Prometheus 文本格式，每个指标的全部样本连续写在它的 HELP/TYPE 之后"""
+        # 先取出每个方法的数值，各个指标使用同一时刻的快照
+        samples = []
+        for path, metrics in sorted(list(self.methods.items())):
+            with metrics.lock:
+                counters = {attr: getattr(metrics, attr) for _, attr, _ in COUNTERS}
+                phases = {phase: (list(histogram.counts), histogram.sum, histogram.count)
+                          for phase, histogram in metrics.phases.items()}
+            samples.append((f'method="{path}"', counters, phases))
+        lines = []
+        for name, attr, help_text in COUNTERS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for label, counters, _ in samples:
+                lines.append(f"{name}{{{label}}} {counters[attr]}")
+        lines.append("# HELP grpc_proxy_phase_seconds Time spent per call in each phase.")
+        lines.append("# TYPE grpc_proxy_phase_seconds histogram")
+        for label, _, phases in samples:
+            for phase, (counts, total, count) in phases.items():
+                labels = f'{label},phase="{phase}"'
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket
+                    lines.append(f'grpc_proxy_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"grpc_proxy_phase_seconds_sum{{{labels}}} {total}")
+                lines.append(f"grpc_proxy_phase_seconds_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# 代理引擎使用的全局指标
+registry = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = registry.render().encode("utf-8")
+        except Exception:
+            print(traceback.format_exc())
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不在控制台输出每次抓取
+
+
+def start_metrics_server(port=METRICS_PORT, host=""):
+    """在后台线程中提供 http://host:port/metrics，返回 HTTP 服务器"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"指标已在 http://{host or '0.0.0.0'}:{port}/metrics 提供")
+    return server
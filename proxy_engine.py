@@ -0,0 +1,1354 @@
+"""代理引擎：转发、抓包记录和拦截流程，不依赖 tkinter
+
+界面（grpc_proxy.py）和无界面模式（headless.py）都通过实现同一组回调接入：
+log_request_arrival、log_response、set_request、update_status、highlight_error、
+show_response、hold、should_intercept、wait_for_request_release、wait_for_response_release。
+"""
+import grpc
+from concurrent import futures
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf import message_factory, descriptor_pool
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from datetime import datetime
+import json
+import traceback
+import threading
+import time
+import functools
+import base64
+import math
+import asyncio
+import collections
+import itertools
+import struct
+from channel_pool import ChannelPool, CHANNELS_PER_TARGET, LB_POLICY
+from metrics import registry
+
+# 透传模式：未拦截的普通请求直接转发原始字节，只在拦截或界面查看时才解码
+PASSTHROUGH = True
+# 最近渲染过的 JSON 字符串缓存条数
+RENDER_CACHE_SIZE = 256
+# 拦截请求的最长等待时间（秒），None 表示一直等待界面放行
+HOLD_TIMEOUT = None
+# 等待超时后的默认操作："transfer" 原样转发请求，"create" 返回带默认值的响应
+HOLD_TIMEOUT_ACTION = "transfer"
+# 抓包记录的条数上限和负载字节上限，超过后从最旧的记录开始淘汰
+CAPTURE_MAX_ENTRIES = 100000
+CAPTURE_MAX_BYTES = 512 * 1024 * 1024
+
+class HeldCall:
+    """被拦截调用的放行状态，界面线程通过两个 future 放行请求和响应"""
+    __slots__ = ("request_future", "response_future")
+
+    def __init__(self):
+        self.request_future = futures.Future()
+        self.response_future = futures.Future()
+
+    @staticmethod
+    def resolve(future, result):
+        # 超时后 future 可能已被取消，迟到的放行直接忽略
+        try:
+            future.set_result(result)
+        except futures.InvalidStateError:
+            pass
+
+    def release_request(self, action, content):
+        self.resolve(self.request_future, (action, content))
+
+    def release_response(self, content):
+        self.resolve(self.response_future, content)
+
+    def abandon(self):
+        # 记录被清除或淘汰时直接放行，调用方使用原始请求和响应继续处理
+        self.release_request(HOLD_TIMEOUT_ACTION, None)
+        self.release_response(None)
+
+def payload_size(content):
+    """估算抓包内容占用的字节数"""
+    if isinstance(content, RawMessage):
+        return len(content.data)
+    if isinstance(content, RawMessageList):
+        return content.size
+    if isinstance(content, str):
+        return len(content)
+    return 0
+
+def row_values(time, server_name, method, status, elapsed, resent, stream_error):
+    # 请求列表中显示的一行，有耗时的记录在状态后显示耗时，重新发送的记录加上标记；
+    # 流式响应出错时原因不在响应框中，显示在状态后
+    if elapsed is not None:
+        status = f"{status} {elapsed * 1000:.1f}ms"
+    if stream_error is not None:
+        status += f"：{stream_error}"
+    if resent:
+        status += "（重新发送）"
+    return (time, server_name, method, status)
+
+def row_tags(status):
+    return ('error',) if status == "出错" else ()
+
+class ServiceInfo:
+    """被代理服务的信息，每个服务只保存一份"""
+    __slots__ = ("server_name", "methods", "stub")
+
+    def __init__(self, server_name, methods, stub):
+        self.server_name = server_name
+        self.methods = methods  # {方法名: MethodInfo}，会话中找不到服务定义时为 None
+        self.stub = stub
+
+class CaptureRecord:
+    """一次调用的抓包记录"""
+    __slots__ = ("id", "time", "service", "method", "status", "request", "response", "held", "size", "search_text",
+                 "elapsed", "resent", "error")
+
+    def __init__(self, record_id, time, service, method, request):
+        self.id = record_id
+        self.time = time
+        self.service = service
+        self.method = method
+        self.status = ""
+        self.request = request
+        self.response = ""
+        self.held = None
+        self.size = payload_size(request)
+        self.search_text = None
+        self.elapsed = None  # 调用耗时（秒），只有界面上重新发送的调用记录
+        self.resent = False  # 是否是界面上重新发送的调用
+        self.error = None    # 出错原因，流式调用出错时响应中仍保留已经收到的消息
+
+    def values(self):
+        stream_error = self.error if isinstance(self.response, RawMessageList) else None
+        return row_values(self.time, self.service.server_name, self.method, self.status, self.elapsed, self.resent, stream_error)
+
+    def tags(self):
+        return row_tags(self.status)
+
+    def text(self, field, render):
+        # 搜索用的小写文本，按字段分别在第一次用到时生成并缓存；流式调用的消息列表
+        # 会继续增长，每次重新生成
+        cache = self.search_text
+        if cache is None:
+            cache = self.search_text = [None, None, None, None]
+        text = cache[field]
+        if text is None:
+            value = (self.method, self.service.server_name, self.request, self.response)[field]
+            text = render(value).lower()
+            if not isinstance(value, RawMessageList):
+                cache[field] = text
+        return text
+
+    def search_bytes(self):
+        # 计入负载大小的搜索文本，只包括请求和响应
+        cache = self.search_text
+        return sum(len(text) for text in cache[2:] if text is not None) if cache is not None else 0
+
+class CaptureStore:
+    """抓包记录存储
+
+    记录的 id 单调递增，清除后也不会重复使用。条数超过 max_entries 或负载超过
+    max_bytes 时，像环形缓冲区一样从最旧的记录开始淘汰，淘汰的记录交给 on_evict。
+    """
+    def __init__(self, max_entries=CAPTURE_MAX_ENTRIES, max_bytes=CAPTURE_MAX_BYTES, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.records = collections.OrderedDict()
+        self.services = {}
+        self.total_bytes = 0
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(list(self.records.values()))
+
+    def record_ids(self):
+        # 按 id 升序返回全部记录 id
+        return list(self.records)
+
+    def get(self, record_id):
+        return self.records.get(record_id)
+
+    def row(self, record_id):
+        """返回请求列表中一行的 (values, tags)，记录不存在时返回 None"""
+        record = self.records.get(record_id)
+        return (record.values(), record.tags()) if record is not None else None
+
+    def service(self, server_name, methods, stub):
+        key = (server_name, stub)
+        info = self.services.get(key)
+        if info is None:
+            info = self.services.setdefault(key, ServiceInfo(server_name, methods, stub))
+        return info
+
+    def add(self, service, method, request, time):
+        with self.lock:
+            record = CaptureRecord(next(self.ids), time, service, method, request)
+            self.records[record.id] = record
+            self.total_bytes += record.size
+            evicted = self.evict()
+        for old in evicted:
+            self.evicted(old)
+        return record
+
+    def set_request(self, record, request):
+        record.request = request
+        record.search_text = None
+        self.resize(record)
+
+    def set_response(self, record, response):
+        record.response = response
+        record.search_text = None
+        self.resize(record)
+
+    def set_error(self, record, error):
+        # 流式调用保留已经收到的消息，只有没有响应内容的调用用错误信息作为响应
+        record.error = error
+        if not isinstance(record.response, RawMessageList):
+            self.set_response(record, error)
+
+    def text(self, record, field, render):
+        # 缓存的请求和响应搜索文本和消息内容一样计入 total_bytes，受 max_bytes 限制；
+        # 方法名和服务名很短，不计入
+        cache = record.search_text
+        if cache is not None and cache[field] is not None:
+            return cache[field]
+        text = record.text(field, render)
+        if field < 2:
+            return text
+        cache = record.search_text  # gRPC 线程可能已经清空了缓存
+        if cache is not None and cache[field] is not None:
+            with self.lock:
+                if record.id in self.records:
+                    self.total_bytes += len(text)
+                record.size += len(text)
+        return text
+
+    def resize(self, record):
+        size = payload_size(record.request) + payload_size(record.response) + record.search_bytes()
+        with self.lock:
+            if record.id in self.records:
+                self.total_bytes += size - record.size
+            record.size = size
+
+    def evict(self):
+        evicted = []
+        while len(self.records) > self.max_entries or (len(self.records) > 1 and self.total_bytes > self.max_bytes):
+            _, record = self.records.popitem(last=False)
+            self.total_bytes -= record.size
+            evicted.append(record)
+        return evicted
+
+    def remove(self, record_id):
+        # 移除一条记录，已经写入磁盘的记录不需要继续占用内存
+        with self.lock:
+            record = self.records.pop(record_id, None)
+            if record is not None:
+                self.total_bytes -= record.size
+        return record
+
+    def evicted(self, record):
+        if record.held is not None:
+            record.held.abandon()
+        if self.on_evict is not None:
+            self.on_evict(record)
+
+    def clear(self):
+        with self.lock:
+            removed = list(self.records.values())
+            self.records.clear()
+            self.total_bytes = 0
+        for record in removed:
+            if record.held is not None:
+                record.held.abandon()
+
+# 流式内容中每条消息的前缀：到达时间和消息长度
+STREAM_ITEM = struct.Struct("<dI")
+
+def encode_content(content):
+    """把抓包内容编码为 (类型, 消息类型名, 字节)，用于写入抓包日志"""
+    if isinstance(content, RawMessage):
+        return "raw", content.message_class.DESCRIPTOR.full_name, content.data
+    if isinstance(content, RawMessageList):
+        type_name = content.messages[0].message_class.DESCRIPTOR.full_name if content.messages else None
+        return "stream", type_name, b"".join(STREAM_ITEM.pack(t, len(m.data)) + m.data for t, m in zip(content.times, content.messages))
+    return "text", None, (content or "").encode("utf-8")
+
+def decode_content(kind, type_name, data):
+    """encode_content 的逆过程，消息类型在默认的 descriptor pool 中查找"""
+    if kind == "text":
+        return bytes(data).decode("utf-8")
+    try:
+        message_class = message_factory.GetMessageClass(descriptor_pool.Default().FindMessageTypeByName(type_name)) if type_name else None
+    except KeyError:
+        return f"未知的消息类型 {type_name}，共 {len(data)} 字节"
+    if kind == "raw":
+        return RawMessage(bytes(data), message_class)
+    messages = RawMessageList()
+    offset = 0
+    while offset < len(data):
+        timestamp, length = STREAM_ITEM.unpack_from(data, offset)
+        offset += STREAM_ITEM.size
+        messages.append(RawMessage(bytes(data[offset:offset + length]), message_class), timestamp)
+        offset += length
+    return messages
+
+def encode_record(record):
+    """返回写入抓包日志的 (元数据, 请求字节, 响应字节)"""
+    request_kind, request_type, request = encode_content(record.request)
+    response_kind, response_type, response = encode_content(record.response)
+    methods = record.service.methods
+    meta = {"id": record.id, "time": record.time, "server": record.service.server_name,
+            "method": record.method, "status": record.status, "elapsed": record.elapsed, "resent": record.resent,
+            "error": record.error,
+            # 方法的完整路径，浏览会话和重放时用来找回方法表
+            "path": methods[record.method].path if methods and record.method in methods else None,
+            "request_kind": request_kind, "request_type": request_type,
+            "response_kind": response_kind, "response_type": response_type}
+    return meta, request, response
+
+class SessionStore:
+    """以只读方式浏览磁盘上的抓包会话
+
+    接口与 CaptureStore 相同，记录 id 就是它在日志中的序号，访问时才通过 mmap
+    读取并解码，只缓存最近访问过的记录；界面上的修改不会写回日志。
+    """
+    def __init__(self, capture_log, cache_size=RENDER_CACHE_SIZE):
+        self.log = capture_log
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.services = {}
+
+    def __len__(self):
+        return len(self.log)
+
+    def __iter__(self):
+        return (self.get(i) for i in range(len(self.log)))
+
+    def record_ids(self):
+        return range(len(self.log))
+
+    def get(self, record_id):
+        if record_id is None or not 0 <= record_id < len(self.log):
+            return None
+        record = self.cache.get(record_id)
+        if record is not None:
+            self.cache.move_to_end(record_id)
+            return record
+        meta, request, response = self.log.read(record_id)
+        service = self.services.get(meta["server"])
+        if service is None or (service.methods is None and meta.get("path")):
+            service = self.services[meta["server"]] = ServiceInfo(meta["server"], self.method_table(meta.get("path")), None)
+        record = CaptureRecord(record_id, meta["time"], service, meta["method"],
+                               decode_content(meta["request_kind"], meta["request_type"], request))
+        record.response = decode_content(meta["response_kind"], meta["response_type"], response)
+        record.status = meta["status"]
+        record.elapsed = meta.get("elapsed")
+        record.resent = meta.get("resent", False)
+        record.error = meta.get("error")
+        self.cache[record_id] = record
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return record
+
+    def row(self, record_id):
+        # 列表只需要元数据，没有缓存的记录不读取和解码请求、响应
+        if record_id is None or not 0 <= record_id < len(self.log):
+            return None
+        record = self.cache.get(record_id)
+        if record is not None:
+            return record.values(), record.tags()
+        meta = self.log.read_meta(record_id)
+        stream_error = meta.get("error") if meta["response_kind"] == "stream" else None
+        return (row_values(meta["time"], meta["server"], meta["method"], meta["status"], meta.get("elapsed"),
+                           meta.get("resent", False), stream_error), row_tags(meta["status"]))
+
+    @staticmethod
+    def method_table(path):
+        # 按 /服务/方法 路径在默认的 descriptor pool 中查找服务，旧的日志没有路径
+        if not path:
+            return None
+        try:
+            method = descriptor_pool.Default().FindMethodByName(path.strip("/").replace("/", "."))
+        except KeyError:
+            return None
+        return method_table(method.containing_service)
+
+    def set_request(self, record, request):
+        record.request = request
+        record.search_text = None
+
+    def set_response(self, record, response):
+        record.response = response
+        record.search_text = None
+
+    def text(self, record, field, render):
+        # 会话只缓存最近访问的记录，不需要计入大小
+        return record.text(field, render)
+
+# 按消息类型编译好的转换函数，以 descriptor 的 full_name 为键缓存
+_DICT_CONVERTERS = {}
+_DICT_PARSERS = {}
+_COMPILE_LOCK = threading.RLock()
+# 这些内置类型的 JSON 形式不是普通的字段字典，按 MessageToDict 的形式展示，交给 ParseDict 解析；
+# 值是未设置时展示的默认值
+_PARSE_DICT_TYPES = {"google.protobuf.Any": dict, "google.protobuf.Struct": dict,
+                     "google.protobuf.Value": lambda: None, "google.protobuf.ListValue": list}
+_INT64_TYPES = (FieldDescriptor.CPPTYPE_INT64, FieldDescriptor.CPPTYPE_UINT64)
+_FLOAT_TYPES = (FieldDescriptor.CPPTYPE_FLOAT, FieldDescriptor.CPPTYPE_DOUBLE)
+_INT_TYPES = (FieldDescriptor.CPPTYPE_INT32, FieldDescriptor.CPPTYPE_UINT32) + _INT64_TYPES
+
+def _is_map_field(field):
+    return (field.type == FieldDescriptor.TYPE_MESSAGE and field.message_type.has_options
+            and field.message_type.GetOptions().map_entry)
+
+def _float_to_json(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return value
+
+def _scalar_to_json(field):
+    """返回单个标量值转 JSON 的函数，格式与 MessageToDict 一致"""
+    if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        values = field.enum_type.values_by_number
+        return lambda value: values[value].name if value in values else value
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return lambda value: base64.b64encode(value).decode("utf-8")
+    if field.cpp_type in _INT64_TYPES:
+        return str
+    if field.cpp_type == FieldDescriptor.CPPTYPE_FLOAT:
+        return lambda value: _float_to_json(ToShortestFloat(value))
+    if field.cpp_type == FieldDescriptor.CPPTYPE_DOUBLE:
+        return _float_to_json
+    return None
+
+def _json_form_to_dict(descriptor):
+    def convert(message):
+        try:
+            return MessageToDict(message, preserving_proto_field_name=True)
+        except TypeError:
+            # Any 中的类型找不到定义时无法生成 JSON 形式，退回字段形式
+            return {"type_url": message.type_url, "value": base64.b64encode(message.value).decode("utf-8")}
+
+    convert.defaults = _PARSE_DICT_TYPES[descriptor.full_name]
+    return convert
+
+def _compile_to_dict(descriptor, pending, stack):
+    converter = _DICT_CONVERTERS.get(descriptor.full_name) or pending.get(descriptor.full_name)
+    if converter is not None:
+        return converter
+    if descriptor.full_name in _PARSE_DICT_TYPES:
+        converter = pending[descriptor.full_name] = _json_form_to_dict(descriptor)
+        return converter
+    template = {}       # 按 descriptor.fields 顺序排列的默认值，列表和嵌套消息先占位
+    factories = []      # 列表和嵌套消息的默认值，每次都要新建
+    to_json = {}        # 已设置字段的转换函数
+
+    def defaults():
+        result = dict(template)
+        for name, factory in factories:
+            result[name] = factory()
+        return result
+
+    def convert(message):
+        result = defaults()
+        for field, value in message.ListFields():
+            fn = to_json.get(field.name)
+            if fn is not None:
+                result[field.name] = fn(value)
+        return result
+
+    convert.defaults = defaults
+    pending[descriptor.full_name] = convert
+    stack.add(descriptor.full_name)
+    for field in descriptor.fields:
+        name = field.name
+        if _is_map_field(field):
+            value_field = field.message_type.fields_by_name["value"]
+            if value_field.type == FieldDescriptor.TYPE_MESSAGE:
+                value_fn = _compile_to_dict(value_field.message_type, pending, stack)
+            else:
+                value_fn = _scalar_to_json(value_field) or (lambda value: value)
+            to_json[name] = lambda value, fn=value_fn: {str(k).lower() if isinstance(k, bool) else str(k): fn(v) for k, v in value.items()}
+        elif field.type == FieldDescriptor.TYPE_MESSAGE:
+            sub_convert = _compile_to_dict(field.message_type, pending, stack)
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                to_json[name] = lambda value, fn=sub_convert: [fn(item) for item in value]
+            else:
+                to_json[name] = sub_convert
+        else:
+            scalar_fn = _scalar_to_json(field)
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                to_json[name] = (lambda value, fn=scalar_fn: [fn(item) for item in value]) if scalar_fn else list
+            else:
+                to_json[name] = scalar_fn or (lambda value: value)
+        # 未设置字段的默认值，替换占位的值不改变字段顺序
+        template[name] = None
+        if _is_map_field(field):
+            factories.append((name, dict))
+        elif field.label == FieldDescriptor.LABEL_REPEATED:
+            factories.append((name, list))
+        elif field.type == FieldDescriptor.TYPE_MESSAGE:
+            if field.message_type.full_name in stack:
+                # 递归引用自身的消息类型不再展开，避免无限递归
+                factories.append((name, dict))
+            else:
+                factories.append((name, to_json[name].defaults))
+        elif field.type == FieldDescriptor.TYPE_BYTES:
+            template[name] = base64.b64encode(field.default_value).decode("utf-8")
+        else:
+            template[name] = field.default_value
+    stack.discard(descriptor.full_name)
+    return convert
+
+def get_dict_converter(descriptor):
+    converter = _DICT_CONVERTERS.get(descriptor.full_name)
+    if converter is None:
+        with _COMPILE_LOCK:
+            pending = {}
+            converter = _compile_to_dict(descriptor, pending, set())
+            _DICT_CONVERTERS.update(pending)
+    return converter
+
+def message_to_dict_with_defaults(proto_obj):
+    """把消息转换为字典，未设置的字段填充默认值，嵌套消息同样展开"""
+    return get_dict_converter(proto_obj.DESCRIPTOR)(proto_obj)
+
+def _scalar_from_json(field):
+    """返回单个 JSON 值转标量的函数，接受 MessageToDict 输出的各种形式"""
+    if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+        values = field.enum_type.values_by_name
+        def parse_enum(value):
+            if isinstance(value, str):
+                if value not in values:
+                    raise ParseError(f'Invalid enum value {value} for enum type {field.enum_type.full_name}.')
+                return values[value].number
+            return value
+        return parse_enum
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        def parse_bytes(value):
+            value = value + "=" * (-len(value) % 4)
+            if "-" in value or "_" in value:
+                return base64.urlsafe_b64decode(value)
+            return base64.b64decode(value)
+        return parse_bytes
+    if field.cpp_type in _INT_TYPES:
+        return lambda value: int(value) if isinstance(value, str) else value
+    if field.cpp_type in _FLOAT_TYPES:
+        return lambda value: float(value) if isinstance(value, str) else value
+    return lambda value: value
+
+def _map_key_from_json(field):
+    if field.cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        return lambda key: key == "true" if isinstance(key, str) else key
+    if field.cpp_type in _INT_TYPES:
+        return int
+    return lambda key: key
+
+def _json_form_from_dict(value, message):
+    # 与 _json_form_to_dict 对应，字段形式的 Any 直接设置 type_url 和 value
+    if isinstance(value, dict) and "type_url" in value:
+        message.type_url = value["type_url"]
+        message.value = base64.b64decode(value.get("value", ""))
+        return message
+    return ParseDict(value, message)
+
+def _compile_from_dict(descriptor, pending):
+    parser = _DICT_PARSERS.get(descriptor.full_name) or pending.get(descriptor.full_name)
+    if parser is not None:
+        return parser
+    if descriptor.full_name in _PARSE_DICT_TYPES:
+        pending[descriptor.full_name] = _json_form_from_dict
+        return _json_form_from_dict
+    setters = {}
+
+    def parse(value, message):
+        if not isinstance(value, dict):
+            raise ParseError(f"Message type {descriptor.full_name} expects a JSON object, got {value!r}.")
+        for key, item in value.items():
+            setter = setters.get(key)
+            if setter is None:
+                raise ParseError(f'Message type "{descriptor.full_name}" has no field named "{key}".')
+            if item is not None:
+                setter(message, item)
+        return message
+
+    pending[descriptor.full_name] = parse
+    for field in descriptor.fields:
+        name = field.name
+        if _is_map_field(field):
+            key_fn = _map_key_from_json(field.message_type.fields_by_name["key"])
+            value_field = field.message_type.fields_by_name["value"]
+            if value_field.type == FieldDescriptor.TYPE_MESSAGE:
+                value_parse = _compile_from_dict(value_field.message_type, pending)
+                def setter(message, item, name=name, key_fn=key_fn, value_parse=value_parse):
+                    container = getattr(message, name)
+                    for k, v in item.items():
+                        value_parse(v, container[key_fn(k)])
+            else:
+                value_fn = _scalar_from_json(value_field)
+                def setter(message, item, name=name, key_fn=key_fn, value_fn=value_fn):
+                    container = getattr(message, name)
+                    for k, v in item.items():
+                        container[key_fn(k)] = value_fn(v)
+        elif field.type == FieldDescriptor.TYPE_MESSAGE:
+            sub_parse = _compile_from_dict(field.message_type, pending)
+            if (field.message_type.full_name.startswith("google.protobuf.")
+                    and field.message_type.full_name not in _PARSE_DICT_TYPES):
+                # Timestamp、Duration 等内置类型也接受字符串形式
+                sub_parse = lambda item, sub, fn=sub_parse: fn(item, sub) if isinstance(item, dict) else ParseDict(item, sub)
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                def setter(message, item, name=name, sub_parse=sub_parse):
+                    container = getattr(message, name)
+                    for v in item:
+                        sub_parse(v, container.add())
+            else:
+                def setter(message, item, name=name, sub_parse=sub_parse):
+                    sub = getattr(message, name)
+                    sub.SetInParent()
+                    sub_parse(item, sub)
+        else:
+            value_fn = _scalar_from_json(field)
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                def setter(message, item, name=name, value_fn=value_fn):
+                    getattr(message, name).extend(value_fn(v) for v in item)
+            else:
+                def setter(message, item, name=name, value_fn=value_fn):
+                    setattr(message, name, value_fn(item))
+        setters[name] = setter
+        setters[field.json_name] = setter
+    return parse
+
+def dict_to_message(js_dict, message):
+    """把字典填充到消息中，替代拦截流程中的 ParseDict"""
+    parser = _DICT_PARSERS.get(message.DESCRIPTOR.full_name)
+    if parser is None:
+        with _COMPILE_LOCK:
+            pending = {}
+            parser = _compile_from_dict(message.DESCRIPTOR, pending)
+            _DICT_PARSERS.update(pending)
+    try:
+        return parser(js_dict, message)
+    except ParseError:
+        raise
+    except (TypeError, ValueError, KeyError) as e:
+        raise ParseError(f"Failed to parse {message.DESCRIPTOR.full_name}: {e}") from e
+
+def message_to_dict_str_with_defaults(proto_obj):
+    return json.dumps(message_to_dict_with_defaults(proto_obj), indent=4, ensure_ascii=False)
+
+class RawMessage:
+    """未解码的消息，保存线上的原始字节和消息类型，需要展示时才解码"""
+    __slots__ = ("data", "message_class")
+
+    def __init__(self, data, message_class):
+        self.data = data
+        self.message_class = message_class
+
+    def decode(self):
+        return self.message_class.FromString(self.data)
+
+    @classmethod
+    def of(cls, message):
+        return cls(message.SerializeToString(), type(message))
+
+    def to_json(self):
+        return message_to_dict_str_with_defaults(self.decode())
+
+class RawMessageList:
+    """流式调用中依次收到的多条 RawMessage，同时记录每条消息的到达时间
+
+    设置 max_bytes 后，保存的消息总字节数达到上限时不再保存之后的消息，只计入 dropped；
+    max_bytes 为 0 时不保存任何消息。
+    """
+    __slots__ = ("messages", "times", "size", "max_bytes", "dropped")
+
+    def __init__(self):
+        self.messages = []
+        self.times = []
+        self.size = 0
+        self.max_bytes = None
+        self.dropped = 0
+
+    def append(self, message, timestamp=None):
+        if self.max_bytes is not None and self.size + len(message.data) > self.max_bytes:
+            self.dropped += 1
+            return
+        self.size += len(message.data)
+        self.times.append(time.time() if timestamp is None else timestamp)
+        self.messages.append(message)
+
+    def append_message(self, message):
+        # 追加解码后的消息；不保存内容时不再序列化
+        if self.max_bytes == 0:
+            self.dropped += 1
+            return
+        self.append(RawMessage.of(message))
+
+    def to_json(self):
+        items = [{"time": datetime.fromtimestamp(t).strftime("%H:%M:%S.%f")[:-3],
+                  "message": message_to_dict_with_defaults(m.decode())}
+                 for t, m in zip(self.times, self.messages)]
+        if self.dropped:
+            items.append({"dropped": self.dropped})
+        return json.dumps(items, indent=4, ensure_ascii=False)
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_message(message):
+    """把 RawMessage 渲染为 JSON 字符串，只缓存最近渲染过的结果"""
+    return message.to_json()
+
+class LoggingInterceptor(grpc.ServerInterceptor):
+    def __init__(self, gui, server_name):
+        self.gui = gui
+        self.server_name = server_name
+
+    def intercept_service(self, continuation, handler_call_details):
+        # 检查方法是否已实现
+        method_name = handler_call_details.method
+
+        # 调用链中的下一个处理程序
+        handler = continuation(handler_call_details)
+
+        if handler is None:
+            # 记录未实现的方法调用
+            print(f"方法 {method_name} 未添加到mock服务{self.server_name}")
+            return grpc.unary_unary_rpc_method_handler(
+                lambda request, context: context.abort(grpc.StatusCode.UNIMPLEMENTED, 'Method not implemented')
+            )
+
+        return handler
+    
+class MethodInfo:
+    """服务中一个方法的调用类型和消息类型，启动时从 ServiceDescriptor 生成"""
+    __slots__ = ("name", "path", "kind", "client_streaming", "server_streaming", "request_class", "response_class",
+                 "request_deserializer", "response_serializer", "request_serializer", "response_deserializer")
+
+    def __init__(self, service_descriptor, method):
+        self.name = method.name
+        self.path = f"/{service_descriptor.full_name}/{method.name}"
+        self.client_streaming = method.client_streaming
+        self.server_streaming = method.server_streaming
+        # unary_unary、unary_stream、stream_unary 或 stream_stream
+        self.kind = ("stream_" if method.client_streaming else "unary_") + ("stream" if method.server_streaming else "unary")
+        self.request_class = message_factory.GetMessageClass(method.input_type)
+        self.response_class = message_factory.GetMessageClass(method.output_type)
+        # 注册到服务器和上游存根的序列化函数，统计耗时和与客户端之间收发的字节数
+        metrics = registry.method(self.path)
+        self.request_deserializer = metrics.timed_parser(self.request_class.FromString, incoming=True)
+        self.response_serializer = metrics.timed_serializer(self.response_class.SerializeToString, outgoing=True)
+        self.request_serializer = metrics.timed_serializer(self.request_class.SerializeToString)
+        self.response_deserializer = metrics.timed_parser(self.response_class.FromString)
+
+# 按服务的 full_name 缓存的方法表
+_METHOD_TABLES = {}
+
+def method_table(service_descriptor):
+    """返回服务的 {方法名: MethodInfo}，每个服务只生成一次"""
+    table = _METHOD_TABLES.get(service_descriptor.full_name)
+    if table is None:
+        table = _METHOD_TABLES[service_descriptor.full_name] = {
+            method.name: MethodInfo(service_descriptor, method) for method in service_descriptor.methods}
+    return table
+
+class BaseServicer():
+    """代理服务的基类
+
+    初始化时按 ServiceDescriptor 为每个方法绑定对应调用类型的处理函数，作为实例属性
+    覆盖生成代码中的同名方法；子类需要设置 server_name 和 stub。设置 cache 为
+    ResponseCache 后，未拦截的一元调用命中缓存时不再调用上游；设置 rules 为 RuleSet 后，
+    请求为一元的调用先按规则自动处理，匹配规则的调用不再经过界面拦截。
+    """
+    cache = None
+    rules = None
+
+    def __init__(self, gui, service_descriptor):
+        self.gui = gui
+        self.service_name = service_descriptor.full_name
+        self.methods = method_table(service_descriptor)
+        for method in self.methods.values():
+            setattr(self, method.name, functools.partial(getattr(self, "handle_" + method.kind), method))
+
+    def rpc_handler(self):
+        # 不依赖生成的 *_pb2_grpc 代码，直接按方法表注册到 grpc 服务器
+        return grpc.method_handlers_generic_handler(self.service_name, {
+            method.name: getattr(grpc, method.kind + "_rpc_method_handler")(
+                getattr(self, method.name),
+                request_deserializer=method.request_deserializer,
+                response_serializer=method.response_serializer)
+            for method in self.methods.values()})
+
+    def cache_for(self, method):
+        # 方法配置了缓存时返回 ResponseCache，否则返回 None
+        if self.cache is not None and self.cache.ttl(method) is not None:
+            return self.cache
+        return None
+
+    @staticmethod
+    def cache_key(method, raw_request):
+        # 透传的请求重新解码后确定性序列化，与解码路径的缓存键一致，字段顺序不同的相同请求命中同一项
+        return method.request_class.FromString(raw_request).SerializeToString(deterministic=True)
+
+    def has_rules(self, method):
+        # 有方法名匹配的规则时需要解码请求检查字段条件
+        return self.rules is not None and bool(self.rules.candidates(method))
+
+    def rule_for(self, method, request):
+        return self.rules.match(method, request) if self.rules is not None else None
+
+    def rewrite_request(self, rule, request_id, request):
+        # 按规则修改请求并更新抓包记录
+        if rule.request is None:
+            return request
+        request = rule.rewrite_request(request)
+        self.gui.set_request(request_id, RawMessage.of(request))
+        return request
+
+    def inject_error(self, rule, request_id, context, timer):
+        code, details = rule.error
+        timer.finish(True)
+        self.gui.highlight_error(request_id, f"{code.name}: {details}")
+        self.gui.update_status(request_id, "出错")
+        context.set_code(code)
+        context.set_details(details)
+
+    def apply_rule(self, rule, method, request, request_id, context, timer):
+        """按规则处理一元调用并返回响应，注入错误时返回 None"""
+        if rule.error is not None:
+            self.inject_error(rule, request_id, context, timer)
+            return None
+        if rule.mock:
+            response = rule.mock_response(method, request)
+        else:
+            request = self.rewrite_request(rule, request_id, request)
+            timer.switch("upstream")
+            response = getattr(self.stub, method.name)(request, metadata=context.invocation_metadata())
+            timer.switch("proxy")
+            response = rule.rewrite_response(response, request)
+        self.gui.log_response(request_id, response)
+        self.gui.update_status(request_id, "成功")
+        timer.finish()
+        return response
+
+    def log_arrival(self, method, request):
+        return self.gui.log_request_arrival(self.server_name, method.name, request, self.methods, self.stub)
+
+    def fail(self, request_id, error, context):
+        self.gui.highlight_error(request_id, str(error))
+        self.gui.update_status(request_id, "出错")
+        print(traceback.format_exc())
+        context.set_code(grpc.StatusCode.UNKNOWN)
+
+    def wait_for_request(self, request_id, method, request):
+        # 阻塞等待界面放行，返回操作类型和要转发的请求
+        # 超时或记录已被清除时内容为 None，使用原始请求
+        action, modified_request_json = self.gui.wait_for_request_release(request_id)
+        if action == "transfer" and modified_request_json is not None:
+            # 用修改后的内容更新存储的请求
+            self.gui.set_request(request_id, modified_request_json)
+            request = dict_to_message(json.loads(modified_request_json), method.request_class())
+        return action, request
+
+    def forward_stream(self, request_id, call, responses, context, timer):
+        """逐条转发上游的流式响应并追加到抓包记录，客户端断开时取消上游调用"""
+        context.add_callback(call.cancel)
+        error = "客户端已断开"  # 客户端断开时 grpc 直接关闭这个生成器
+        try:
+            for response in call:
+                responses.append_message(response)
+                yield response
+            if context.is_active():
+                error = None
+        except Exception as e:
+            # 客户端断开时 call.cancel 让上游流以 CANCELLED 结束，不是上游出错
+            if context.is_active():
+                error = str(e)
+                print(traceback.format_exc())
+                context.set_code(grpc.StatusCode.UNKNOWN)
+        finally:
+            timer.finish(error is not None)
+            if error is None:
+                self.gui.update_status(request_id, "成功")
+            else:
+                self.gui.highlight_error(request_id, error)
+                self.gui.update_status(request_id, "出错")
+
+    @staticmethod
+    def capture_requests(request_iter, requests):
+        # grpc 在自己的线程中消费这个迭代器，客户端发来一条就转发一条
+        for request in request_iter:
+            requests.append_message(request)
+            yield request
+
+    def handle_unary_unary(self, method, request, context):
+        timer = registry.timer(method.path)
+        metadata = context.invocation_metadata()
+        request_id = self.log_arrival(method, request)
+        try:
+            rule = self.rule_for(method, request)
+            if rule is not None:
+                return self.apply_rule(rule, method, request, request_id, context, timer)
+            # 检查请求是否应该被拦截
+            if not self.gui.should_intercept(method.name):
+                cache = self.cache_for(method)
+                # 确定性序列化，字段顺序不同的相同请求使用同一个缓存键
+                key = request.SerializeToString(deterministic=True) if cache is not None else None
+                cached = cache.get(method, key) if cache is not None else None
+                if cached is not None:
+                    response = method.response_class.FromString(cached)
+                else:
+                    timer.switch("upstream")
+                    response = getattr(self.stub, method.name)(request, metadata=metadata)
+                    timer.switch("proxy")
+                    if cache is not None:
+                        cache.put(method, key, response.SerializeToString())
+                self.gui.log_response(request_id, response)
+                self.gui.update_status(request_id, "成功")
+                timer.finish()
+                return response
+
+            timer.switch("hold")
+            action, request = self.wait_for_request(request_id, method, request)
+            timer.switch("proxy")
+            if action == "transfer":
+                # 转发请求并获取响应
+                timer.switch("upstream")
+                response = getattr(self.stub, method.name)(request, metadata=metadata)
+                timer.switch("proxy")
+                self.gui.log_response(request_id, response)
+                response_json = message_to_dict_str_with_defaults(response)
+            else:
+                response = method.response_class()
+                response_json = message_to_dict_str_with_defaults(response)
+                self.gui.log_response(request_id, response_json)
+            self.gui.show_response(request_id, response_json)
+            timer.switch("hold")
+            response_json = self.gui.wait_for_response_release(request_id)
+            timer.switch("proxy")
+            if response_json is not None:
+                response = dict_to_message(json.loads(response_json), method.response_class())
+            # 直接将响应返回给请求者
+            self.gui.update_status(request_id, "成功")
+            timer.finish()
+            return response
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+
+    def handle_unary_stream(self, method, request, context):
+        # 服务端流：收到一条转发一条，不等上游结束
+        timer = registry.timer(method.path)
+        request_id = self.log_arrival(method, request)
+        try:
+            rule = self.rule_for(method, request)
+            if rule is not None:
+                # 流式响应不按规则修改
+                if rule.error is not None:
+                    self.inject_error(rule, request_id, context, timer)
+                    return iter(())
+                if rule.mock:
+                    response = rule.mock_response(method, request)
+                    self.gui.log_response(request_id, response)
+                    self.gui.update_status(request_id, "成功")
+                    timer.finish()
+                    return iter((response,))
+                request = self.rewrite_request(rule, request_id, request)
+            elif self.gui.should_intercept(method.name):
+                # 流式响应不能修改，只能在放行前修改请求
+                timer.switch("hold")
+                action, request = self.wait_for_request(request_id, method, request)
+                timer.switch("proxy")
+                if action != "transfer":
+                    response = method.response_class()
+                    self.gui.log_response(request_id, message_to_dict_str_with_defaults(response))
+                    self.gui.update_status(request_id, "成功")
+                    timer.finish()
+                    return iter((response,))
+            responses = RawMessageList()
+            self.gui.log_response(request_id, responses)
+            # 流式调用的上游耗时包括逐条转发，直到上游结束
+            timer.switch("upstream")
+            call = getattr(self.stub, method.name)(request, metadata=context.invocation_metadata())
+            return self.forward_stream(request_id, call, responses, context, timer)
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+
+    def handle_stream_unary(self, method, request_iter, context):
+        timer = registry.timer(method.path)
+        requests = RawMessageList()
+        request_id = self.log_arrival(method, requests)
+        try:
+            timer.switch("upstream")
+            response = getattr(self.stub, method.name)(self.capture_requests(request_iter, requests),
+                                                       metadata=context.invocation_metadata())
+            timer.switch("proxy")
+            self.gui.log_response(request_id, response)
+            self.gui.update_status(request_id, "成功")
+            timer.finish()
+            return response
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+
+    def handle_stream_stream(self, method, request_iter, context):
+        # 每个调用单独建立上游流，两个方向各自转发
+        timer = registry.timer(method.path)
+        requests, responses = RawMessageList(), RawMessageList()
+        request_id = self.log_arrival(method, requests)
+        self.gui.log_response(request_id, responses)
+        timer.switch("upstream")
+        call = getattr(self.stub, method.name)(self.capture_requests(request_iter, requests),
+                                               metadata=context.invocation_metadata())
+        return self.forward_stream(request_id, call, responses, context, timer)
+
+
+class GenericStub:
+    """按方法表生成的客户端存根，用法与生成的 *Stub 类相同"""
+    def __init__(self, channel, methods):
+        for method in methods.values():
+            setattr(self, method.name, getattr(channel, method.kind)(
+                method.path,
+                request_serializer=method.request_serializer,
+                response_deserializer=method.response_deserializer))
+
+class GenericServicer(BaseServicer):
+    """代理任意服务，只需要 ServiceDescriptor，不需要为每个服务编写子类"""
+    def __init__(self, gui, service_descriptor, channel):
+        BaseServicer.__init__(self, gui, service_descriptor)
+        self.stub = GenericStub(channel, self.methods)
+        self.server_name = service_descriptor.full_name
+
+class PassthroughHandler(grpc.GenericRpcHandler):
+    """透传处理器：请求和响应都使用原始字节（不设置序列化函数）
+
+    未被拦截的普通调用直接把线上字节转发给后端，并以 RawMessage 形式记录；
+    被拦截的调用和流式调用解码后交给 servicer 原有的处理流程。
+    """
+    def __init__(self, servicer, channel):
+        self.servicer = servicer
+        self.handlers = {}
+        for method in servicer.methods.values():
+            if method.kind == "unary_unary":
+                self.handlers[method.path] = grpc.unary_unary_rpc_method_handler(
+                    functools.partial(self.forward_unary, method, channel.unary_unary(method.path)))
+                continue
+            make_handler = getattr(grpc, method.kind + "_rpc_method_handler")
+            self.handlers[method.path] = make_handler(
+                getattr(servicer, method.name),
+                request_deserializer=method.request_deserializer,
+                response_serializer=method.response_serializer)
+
+    def service(self, handler_call_details):
+        return self.handlers.get(handler_call_details.method)
+
+    def forward_unary(self, method, forward, raw_request, context):
+        servicer = self.servicer
+        gui = servicer.gui
+        if gui.should_intercept(method.name) or servicer.has_rules(method):
+            # 拦截的请求需要在界面上修改，可能匹配规则的请求需要检查字段，都解码后走原有流程
+            response = servicer.handle_unary_unary(method, method.request_deserializer(raw_request), context)
+            return method.response_serializer(response) if response is not None else None
+        timer = registry.timer(method.path)
+        timer.bytes_in = len(raw_request)
+        request_id = servicer.log_arrival(method, RawMessage(raw_request, method.request_class))
+        try:
+            # 只有配置了缓存的方法才解码请求生成缓存键
+            cache = servicer.cache_for(method)
+            key = servicer.cache_key(method, raw_request) if cache is not None else None
+            raw_response = cache.get(method, key) if cache is not None else None
+            if raw_response is None:
+                timer.switch("upstream")
+                raw_response = forward(raw_request, metadata=context.invocation_metadata())
+                timer.switch("proxy")
+                if cache is not None:
+                    cache.put(method, key, raw_response)
+            gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+            gui.update_status(request_id, "成功")
+            timer.bytes_out = len(raw_response)
+            timer.finish()
+            return raw_response
+        except Exception as e:
+            timer.finish(True)
+            servicer.fail(request_id, e, context)
+
+
+class AioProxyHandler(grpc.GenericRpcHandler):
+    """基于 grpc.aio 的代理处理器，支持抓包、拦截、mock 和流转发
+
+    每个调用都是事件循环上的一个协程，拦截等待和长连接的流不再各占一个线程。
+    请求和响应都以原始字节转发，只在拦截时解码。
+    """
+    def __init__(self, servicer, channel):
+        self.servicer = servicer
+        self.gui = servicer.gui
+        self.handlers = {}
+        for method in servicer.methods.values():
+            upstream = getattr(channel, method.kind)(method.path)
+            make_handler = getattr(grpc, method.kind + "_rpc_method_handler")
+            self.handlers[method.path] = make_handler(functools.partial(getattr(self, method.kind), method, upstream))
+
+    def service(self, handler_call_details):
+        return self.handlers.get(handler_call_details.method)
+
+    def log_arrival(self, method, request):
+        return self.servicer.log_arrival(method, request)
+
+    def fail(self, request_id, error, context):
+        self.servicer.fail(request_id, error, context)
+
+    def cancelled(self, request_id, timer):
+        # 客户端断开时协程收到 CancelledError，不经过 except Exception；成功和出错时都已经
+        # 调用了 timer.finish，没有结束的调用在 finally 中标记为出错
+        if not timer.finished:
+            timer.finish(True)
+            self.gui.highlight_error(request_id, "客户端已断开")
+            self.gui.update_status(request_id, "出错")
+
+    def match_rule(self, method, raw_request):
+        # 只在有方法名匹配的规则时解码请求，返回匹配的规则和解码后的请求
+        if not self.servicer.has_rules(method):
+            return None, None
+        request = method.request_class.FromString(raw_request)
+        return self.servicer.rule_for(method, request), request
+
+    async def apply_rule(self, rule, method, upstream, request, raw_request, request_id, context, timer):
+        # 与 BaseServicer.apply_rule 相同，请求和响应只在规则需要修改时重新编码
+        if rule.error is not None:
+            self.servicer.inject_error(rule, request_id, context, timer)
+            return None
+        if rule.mock:
+            raw_response = rule.mock_response(method, request).SerializeToString()
+        else:
+            if rule.request is not None:
+                request = self.servicer.rewrite_request(rule, request_id, request)
+                raw_request = request.SerializeToString()
+            timer.switch("upstream")
+            raw_response = await upstream(raw_request, metadata=context.invocation_metadata())
+            timer.switch("proxy")
+            if rule.response is not None:
+                raw_response = rule.rewrite_response(method.response_class.FromString(raw_response), request).SerializeToString()
+        self.gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+        self.gui.update_status(request_id, "成功")
+        timer.bytes_out = len(raw_response)
+        timer.finish()
+        return raw_response
+
+    async def wait_for_release(self, future, on_timeout):
+        # 在事件循环上等待界面放行，不占用线程
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), HOLD_TIMEOUT)
+        except asyncio.TimeoutError:
+            return on_timeout
+
+    async def unary_unary(self, method, upstream, raw_request, context):
+        gui = self.gui
+        timer = registry.timer(method.path)
+        timer.bytes_in = len(raw_request)
+        request_id = self.log_arrival(method, RawMessage(raw_request, method.request_class))
+        try:
+            metadata = context.invocation_metadata()
+            rule, request = self.match_rule(method, raw_request)
+            if rule is not None:
+                return await self.apply_rule(rule, method, upstream, request, raw_request, request_id, context, timer)
+            if not gui.should_intercept(method.name):
+                cache = self.servicer.cache_for(method)
+                key = self.servicer.cache_key(method, raw_request) if cache is not None else None
+                raw_response = cache.get(method, key) if cache is not None else None
+                if raw_response is None:
+                    timer.switch("upstream")
+                    raw_response = await upstream(raw_request, metadata=metadata)
+                    timer.switch("proxy")
+                    if cache is not None:
+                        cache.put(method, key, raw_response)
+                gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+                gui.update_status(request_id, "成功")
+                timer.bytes_out = len(raw_response)
+                timer.finish()
+                return raw_response
+
+            held = gui.hold(request_id)
+            timer.switch("hold")
+            action, modified_request_json = await self.wait_for_release(held.request_future, (HOLD_TIMEOUT_ACTION, None))
+            timer.switch("proxy")
+            if action == "transfer":
+                if modified_request_json is not None:
+                    # 用界面上修改后的内容转发请求
+                    gui.set_request(request_id, modified_request_json)
+                    raw_request = dict_to_message(json.loads(modified_request_json), method.request_class()).SerializeToString()
+                timer.switch("upstream")
+                raw_response = await upstream(raw_request, metadata=metadata)
+                timer.switch("proxy")
+                response = method.response_class.FromString(raw_response)
+                gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+            else:
+                response = method.response_class()
+            response_json = message_to_dict_str_with_defaults(response)
+            if action != "transfer":
+                gui.log_response(request_id, response_json)
+            gui.show_response(request_id, response_json)
+            timer.switch("hold")
+            response_json = await self.wait_for_release(held.response_future, None)
+            timer.switch("proxy")
+            if response_json is not None:
+                response = dict_to_message(json.loads(response_json), method.response_class())
+            gui.update_status(request_id, "成功")
+            raw_response = response.SerializeToString()
+            timer.bytes_out = len(raw_response)
+            timer.finish()
+            return raw_response
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+        finally:
+            self.cancelled(request_id, timer)
+
+    async def unary_stream(self, method, upstream, raw_request, context):
+        gui = self.gui
+        timer = registry.timer(method.path)
+        timer.bytes_in = len(raw_request)
+        request_id = self.log_arrival(method, RawMessage(raw_request, method.request_class))
+        call = None
+        try:
+            rule, request = self.match_rule(method, raw_request)
+            if rule is not None:
+                # 流式响应不按规则修改
+                if rule.error is not None:
+                    self.servicer.inject_error(rule, request_id, context, timer)
+                    return
+                if rule.mock:
+                    raw_response = rule.mock_response(method, request).SerializeToString()
+                    gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+                    gui.update_status(request_id, "成功")
+                    timer.bytes_out = len(raw_response)
+                    timer.finish()
+                    yield raw_response
+                    return
+                if rule.request is not None:
+                    raw_request = self.servicer.rewrite_request(rule, request_id, request).SerializeToString()
+            elif gui.should_intercept(method.name):
+                # 流式响应不能修改，只能在放行前修改请求
+                held = gui.hold(request_id)
+                timer.switch("hold")
+                action, modified_request_json = await self.wait_for_release(held.request_future, (HOLD_TIMEOUT_ACTION, None))
+                timer.switch("proxy")
+                if action != "transfer":
+                    response = method.response_class()
+                    gui.log_response(request_id, message_to_dict_str_with_defaults(response))
+                    gui.update_status(request_id, "成功")
+                    timer.finish()
+                    yield response.SerializeToString()
+                    return
+                if modified_request_json is not None:
+                    gui.set_request(request_id, modified_request_json)
+                    raw_request = dict_to_message(json.loads(modified_request_json), method.request_class()).SerializeToString()
+            responses = RawMessageList()
+            gui.log_response(request_id, responses)
+            timer.switch("upstream")
+            call = upstream(raw_request, metadata=context.invocation_metadata())
+            async for raw_response in call:
+                timer.bytes_out += len(raw_response)
+                responses.append(RawMessage(raw_response, method.response_class))
+                yield raw_response
+            timer.finish()
+            gui.update_status(request_id, "成功")
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+        finally:
+            # 客户端断开时协程被取消，同时取消上游调用
+            self.cancelled(request_id, timer)
+            if call is not None:
+                call.cancel()
+
+    async def stream_unary(self, method, upstream, request_iterator, context):
+        timer = registry.timer(method.path)
+        requests = RawMessageList()
+        request_id = self.log_arrival(method, requests)
+        try:
+            timer.switch("upstream")
+            raw_response = await upstream(self.capture_requests(request_iterator, requests, method.request_class, timer),
+                                          metadata=context.invocation_metadata())
+            timer.switch("proxy")
+            self.gui.log_response(request_id, RawMessage(raw_response, method.response_class))
+            self.gui.update_status(request_id, "成功")
+            timer.bytes_out = len(raw_response)
+            timer.finish()
+            return raw_response
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+        finally:
+            self.cancelled(request_id, timer)
+
+    async def stream_stream(self, method, upstream, request_iterator, context):
+        timer = registry.timer(method.path)
+        requests, responses = RawMessageList(), RawMessageList()
+        request_id = self.log_arrival(method, requests)
+        self.gui.log_response(request_id, responses)
+        # 两个方向各自独立转发，不要求请求和响应一一对应
+        timer.switch("upstream")
+        call = upstream(self.capture_requests(request_iterator, requests, method.request_class, timer),
+                        metadata=context.invocation_metadata())
+        try:
+            async for raw_response in call:
+                timer.bytes_out += len(raw_response)
+                responses.append(RawMessage(raw_response, method.response_class))
+                yield raw_response
+            timer.finish()
+            self.gui.update_status(request_id, "成功")
+        except Exception as e:
+            timer.finish(True)
+            self.fail(request_id, e, context)
+        finally:
+            self.cancelled(request_id, timer)
+            call.cancel()
+
+    @staticmethod
+    async def capture_requests(request_iterator, requests, request_class, timer):
+        async for raw_request in request_iterator:
+            timer.bytes_in += len(raw_request)
+            requests.append(RawMessage(raw_request, request_class))
+            yield raw_request
+
+
+def start_generic_server(gui, service_descriptors, upstream, port, channels_per_target=CHANNELS_PER_TARGET, policy=LB_POLICY,
+                         cache=None, rules=None):
+    # 为描述集中的每个服务注册处理器，全部转发到同一组上游地址
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=100), interceptors=[LoggingInterceptor(gui, "generic_server")])
+    client_channel = ChannelPool(upstream, channels_per_target, policy)
+    registry.add_pool(client_channel)
+    for service_descriptor in service_descriptors:
+        servicer = GenericServicer(gui, service_descriptor, client_channel)
+        servicer.cache = cache
+        servicer.rules = rules
+        server.add_generic_rpc_handlers((PassthroughHandler(servicer, client_channel) if PASSTHROUGH else servicer.rpc_handler(),))
+    server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    print(f"代理服务器已在端口 {port} 启动，共 {len(service_descriptors)} 个服务")
+    server.wait_for_termination()
+
+async def serve_aio_generic(gui, service_descriptors, upstream, port, channels_per_target=CHANNELS_PER_TARGET, policy=LB_POLICY,
+                            cache=None, rules=None):
+    server = grpc.aio.server()
+    client_channel = ChannelPool(upstream, channels_per_target, policy, aio=True)
+    registry.add_pool(client_channel)
+    sync_channel = ChannelPool(upstream, 1, policy)
+    for service_descriptor in service_descriptors:
+        servicer = GenericServicer(gui, service_descriptor, sync_channel)
+        servicer.cache = cache
+        servicer.rules = rules
+        server.add_generic_rpc_handlers((AioProxyHandler(servicer, client_channel),))
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
+    print(f"代理服务器(aio)已在端口 {port} 启动，共 {len(service_descriptors)} 个服务")
+    await server.wait_for_termination()
+
+def start_aio_generic_server(gui, service_descriptors, upstream, port, channels_per_target=CHANNELS_PER_TARGET, policy=LB_POLICY,
+                             cache=None, rules=None):
+    asyncio.run(serve_aio_generic(gui, service_descriptors, upstream, port, channels_per_target, policy, cache, rules))
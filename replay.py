@@ -0,0 +1,266 @@
+import json
+import time
+import random
+import threading
+import itertools
+import traceback
+import argparse
+import collections
+from array import array
+import grpc
+from capture_log import CaptureLog
+from descriptor_sets import load_services, DESCRIPTOR_CACHE_DIR
+from channel_pool import ChannelPool, CHANNELS_PER_TARGET, LB_POLICY
+from proxy_engine import SessionStore, RawMessage, RawMessageList, dict_to_message
+
+# 重放的默认目标地址
+REPLAY_TARGET = "localhost:50051"
+# 同时进行的调用数
+REPLAY_CONCURRENCY = 16
+# 每个调用的超时（秒）
+REPLAY_TIMEOUT = 30
+# 报告中的延迟分位数
+REPLAY_PERCENTILES = (50, 95, 99)
+
+
+class ReplayCall:
+    """一个待重放的调用：方法和序列化后的请求，客户端流的请求是字节列表"""
+    __slots__ = ("method", "request")
+
+    def __init__(self, method, request):
+        self.method = method
+        self.request = request
+
+
+def request_payload(content, method):
+    # 抓包内容转换为请求字节，界面上修改过的内容是 JSON 文本
+    if isinstance(content, RawMessage):
+        return content.data
+    if isinstance(content, RawMessageList):
+        return [message.data for message in content.messages]
+    data = json.loads(content)
+    if method.client_streaming:
+        return [dict_to_message(item["message"], method.request_class()).SerializeToString() for item in data]
+    return dict_to_message(data, method.request_class()).SerializeToString()
+
+
+def calls_from_records(records):
+    """把抓包记录转换为 ReplayCall，跳过找不到方法定义或请求无法解析的记录"""
+    calls = []
+    for record in records:
+        methods = record.service.methods
+        method = methods.get(record.method) if methods else None
+        if method is None:
+            print(f"找不到方法 {record.service.server_name}.{record.method} 的定义，跳过")
+            continue
+        try:
+            calls.append(ReplayCall(method, request_payload(record.request, method)))
+        except Exception:
+            print(f"{record.method} 的请求无法解析，跳过")
+            print(traceback.format_exc())
+    return calls
+
+
+def calls_from_session(directory):
+    """读取磁盘上的抓包会话，消息类型需要已经加载到默认的 descriptor pool"""
+    capture_log = CaptureLog(directory)
+    try:
+        return calls_from_records(SessionStore(capture_log))
+    finally:
+        capture_log.close()
+
+
+def percentile(sorted_values, p):
+    # 最近秩法，sorted_values 不能为空
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class MethodStats:
+    """一个方法的调用次数、错误和延迟"""
+    __slots__ = ("latencies", "errors")
+
+    def __init__(self):
+        self.latencies = array("d")           # 每次调用的延迟（秒）
+        self.errors = collections.Counter()   # 状态码名 -> 次数
+
+
+class ReplayReport:
+    """按方法统计的重放结果"""
+    def __init__(self):
+        self.methods = collections.defaultdict(MethodStats)
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(stats.latencies) for stats in self.methods.values())
+
+    def add(self, path, latency, code):
+        with self.lock:
+            stats = self.methods[path]
+            stats.latencies.append(latency)
+            if code != grpc.StatusCode.OK:
+                stats.errors[code.name] += 1
+
+    def rows(self):
+        """每个方法的 (路径, 调用数, 错误数, 每秒调用数, 各分位数延迟毫秒)"""
+        with self.lock:
+            items = [(path, sorted(stats.latencies), sum(stats.errors.values())) for path, stats in self.methods.items()]
+        elapsed = self.elapsed or 1e-9
+        return [(path, len(latencies), errors, len(latencies) / elapsed,
+                 [percentile(latencies, p) * 1000 for p in REPLAY_PERCENTILES])
+                for path, latencies, errors in sorted(items)]
+
+    def format(self):
+        lines = [f"共 {len(self)} 次调用，用时 {self.elapsed:.2f} 秒，{len(self) / (self.elapsed or 1e-9):.1f} 次/秒",
+                 "方法\t调用\t错误\t次/秒\t" + "\t".join(f"p{p}(ms)" for p in REPLAY_PERCENTILES)]
+        for path, count, errors, qps, latencies in self.rows():
+            lines.append(f"{path}\t{count}\t{errors}\t{qps:.1f}\t" + "\t".join(f"{latency:.2f}" for latency in latencies))
+        with self.lock:
+            for path, stats in sorted(self.methods.items()):
+                if stats.errors:
+                    lines.append(f"{path} 错误: " + ", ".join(f"{name} x{count}" for name, count in stats.errors.most_common()))
+        return "\n".join(lines)
+
+
+class Replayer:
+    """按设定的速率或并发重放一组调用
+
+    concurrency 个线程各自取下一个调用并等待它完成；qps 不为 0 时按固定间隔排定
+    每个调用的开始时间，jitter_ms 在此基础上为每个调用随机增加 0~jitter_ms 毫秒的延迟。
+    loops 为 0 时循环重放，直到 duration 秒后或调用 stop()。请求以原始字节发送，
+    不需要解码。
+    """
+    def __init__(self, channel, calls, qps=0, concurrency=REPLAY_CONCURRENCY, loops=1, duration=None,
+                 jitter_ms=0, timeout=REPLAY_TIMEOUT):
+        if not calls:
+            raise ValueError("没有可以重放的调用")
+        self.calls = list(calls)
+        self.qps = qps
+        self.concurrency = concurrency
+        self.duration = duration
+        self.jitter = jitter_ms / 1000
+        self.timeout = timeout
+        self.report = ReplayReport()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.started = None
+        if loops:
+            self.schedule = itertools.chain.from_iterable(itertools.repeat(self.calls, loops))
+        else:
+            self.schedule = itertools.cycle(self.calls)
+        # 不设置序列化函数，请求和响应都是原始字节
+        self.callables = {}
+        for call in self.calls:
+            method = call.method
+            if method.path not in self.callables:
+                self.callables[method.path] = getattr(channel, method.kind)(method.path)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        """阻塞直到重放结束，返回 ReplayReport"""
+        self.started = time.perf_counter()
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.report.elapsed = time.perf_counter() - self.started
+        return self.report
+
+    def next_call(self):
+        with self.lock:
+            now = time.perf_counter()
+            if self.stopped.is_set() or (self.duration and now - self.started >= self.duration):
+                return None
+            call = next(self.schedule, None)
+            if call is None:
+                return None
+            index = self.issued
+            self.issued += 1
+        delay = self.started + index / self.qps - now if self.qps else 0
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0 and self.stopped.wait(delay):
+            return None
+        return call
+
+    def worker(self):
+        while True:
+            call = self.next_call()
+            if call is None:
+                return
+            start = time.perf_counter()
+            code = grpc.StatusCode.OK
+            try:
+                self.invoke(call)
+            except grpc.RpcError as e:
+                code = e.code()
+            except Exception:
+                code = grpc.StatusCode.UNKNOWN
+                print(traceback.format_exc())
+            self.report.add(call.method.path, time.perf_counter() - start, code)
+
+    def invoke(self, call):
+        # 流式响应全部收完才算调用结束
+        multicallable = self.callables[call.method.path]
+        kind = call.method.kind
+        if kind == "unary_unary":
+            multicallable(call.request, timeout=self.timeout)
+        elif kind == "unary_stream":
+            for _ in multicallable(call.request, timeout=self.timeout):
+                pass
+        elif kind == "stream_unary":
+            multicallable(iter(call.request), timeout=self.timeout)
+        else:
+            for _ in multicallable(iter(call.request), timeout=self.timeout):
+                pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="按抓包会话重放 gRPC 调用并统计吞吐量和延迟")
+    parser.add_argument("session", help="抓包会话目录（session-时间）")
+    parser.add_argument("-d", "--descriptor-set", action="append", default=[],
+                        help="会话中消息类型的描述文件或目录，可重复指定")
+    parser.add_argument("-t", "--target", default=REPLAY_TARGET, help="重放的目标地址，多个地址用逗号分隔")
+    parser.add_argument("--qps", type=float, default=0, help="目标每秒调用数，0 表示不限速")
+    parser.add_argument("-c", "--concurrency", type=int, default=REPLAY_CONCURRENCY, help="同时进行的调用数")
+    parser.add_argument("-n", "--loops", type=int, default=1, help="重放的轮数，0 表示循环直到 --duration")
+    parser.add_argument("--duration", type=float, help="最长运行时间（秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="每个调用随机增加的最大延迟（毫秒）")
+    parser.add_argument("--timeout", type=float, default=REPLAY_TIMEOUT, help="每个调用的超时（秒）")
+    parser.add_argument("--channels", type=int, default=CHANNELS_PER_TARGET, help="每个目标地址建立的连接数")
+    parser.add_argument("--lb", choices=("round_robin", "least_outstanding"), default=LB_POLICY, help="选择连接的策略")
+    parser.add_argument("--cache-dir", default=DESCRIPTOR_CACHE_DIR, help="描述集缓存目录，传入空字符串表示不缓存")
+    args = parser.parse_args(argv)
+    if args.loops == 0 and not args.duration:
+        parser.error("--loops 0 需要同时指定 --duration")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.descriptor_set:
+        load_services(args.descriptor_set, args.cache_dir or None)
+    calls = calls_from_session(args.session)
+    print(f"从 {args.session} 读取了 {len(calls)} 个调用")
+    channel = ChannelPool(args.target.split(","), args.channels, args.lb)
+    replayer = Replayer(channel, calls, args.qps, args.concurrency, args.loops, args.duration, args.jitter_ms, args.timeout)
+    try:
+        report = replayer.run()
+    except KeyboardInterrupt:
+        # 中断时只统计已经完成的调用
+        replayer.stop()
+        report = replayer.report
+        report.elapsed = time.perf_counter() - replayer.started
+    finally:
+        channel.close()
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
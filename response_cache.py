@@ -0,0 +1,86 @@
+import re
+import time
+import threading
+import collections
+from metrics import registry
+
+# 缓存的条数上限和响应字节上限，超过后淘汰最久未使用的条目
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+def parse_cache_rules(values):
+    """解析命令行的 "方法正则=秒数"，返回 [(正则, 秒数)]"""
+    rules = []
+    for value in values:
+        pattern, sep, ttl = value.rpartition("=")
+        if not sep or not pattern:
+            raise ValueError(f"缓存规则应为 方法正则=秒数: {value}")
+        rules.append((pattern, float(ttl)))
+    return rules
+
+
+class ResponseCache:
+    """一元方法的响应缓存
+
+    键是方法路径和序列化后的请求字节，值是序列化后的响应字节。rules 是 [(正则, 秒数)]，
+    按顺序用第一条在方法路径（/包名.服务/方法）中匹配的规则决定缓存时间，没有匹配的方法
+    不缓存。过期的条目在下次访问时删除，总条数或总字节超过上限时按 LRU 淘汰。
+    """
+    def __init__(self, rules, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.rules = [(re.compile(pattern), ttl) for pattern, ttl in rules]
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = {}  # 方法路径 -> 缓存时间，None 表示不缓存
+        self.entries = collections.OrderedDict()  # (方法路径, 请求字节) -> (过期时间, 响应字节)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ttl(self, method):
+        # 每个方法只匹配一次规则
+        try:
+            return self.ttls[method.path]
+        except KeyError:
+            ttl = next((ttl for pattern, ttl in self.rules if pattern.search(method.path)), None)
+            self.ttls[method.path] = ttl
+            return ttl
+
+    def get(self, method, request):
+        """返回缓存的响应字节，没有或已过期时返回 None"""
+        key = (method.path, request)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                else:
+                    self.discard(key)
+                    entry = None
+        registry.method(method.path).cache_lookup(entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, method, request, response):
+        ttl = self.ttl(method)
+        if ttl is None:
+            return
+        key = (method.path, request)
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (time.monotonic() + ttl, response)
+            self.total_bytes += len(request) + len(response)
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        # 调用方持有锁
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(key[1]) + len(entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
@@ -0,0 +1,153 @@
+import os
+import re
+import json
+import time
+import threading
+import traceback
+import grpc
+from google.protobuf.message import Message
+from proxy_engine import dict_to_message, message_to_dict_with_defaults
+
+# 检查规则文件是否修改的间隔（秒），0 表示不自动重新加载
+RULES_RELOAD_INTERVAL = 1.0
+
+_PLACEHOLDER = re.compile(r"\$\{([\w.]+)\}")
+
+
+def field_value(message, path):
+    """按 ("a", "b") 读取消息中的字段，子消息转换为字典，重复字段转换为列表"""
+    value = message
+    for name in path:
+        value = getattr(value, name)
+    if isinstance(value, Message):
+        return message_to_dict_with_defaults(value)
+    if isinstance(value, (str, bytes, int, float)):
+        return value
+    return [message_to_dict_with_defaults(item) if isinstance(item, Message) else item for item in value]
+
+
+def compile_template(value):
+    """编译字段模板，返回 fn(request) -> 字典
+
+    字符串中的 ${字段.子字段} 替换为请求中的字段值；整个字符串只有一个占位符时保留字段原来的类型。
+    """
+    if "${" not in json.dumps(value, ensure_ascii=False):
+        return lambda request: value
+    if isinstance(value, dict):
+        items = [(key, compile_template(item)) for key, item in value.items()]
+        return lambda request: {key: fn(request) for key, fn in items}
+    if isinstance(value, list):
+        items = [compile_template(item) for item in value]
+        return lambda request: [fn(request) for fn in items]
+    whole = _PLACEHOLDER.fullmatch(value)
+    if whole:
+        path = tuple(whole.group(1).split("."))
+        return lambda request: field_value(request, path)
+    return lambda request: _PLACEHOLDER.sub(lambda m: str(field_value(request, m.group(1).split("."))), value)
+
+
+def override_fields(message, fields):
+    # 用字典覆盖消息的顶层字段，重复字段和 map 整体替换
+    descriptor = message.DESCRIPTOR
+    for key in fields:
+        field = descriptor.fields_by_name.get(key) or descriptor.fields_by_camelcase_name.get(key)
+        if field is not None:
+            message.ClearField(field.name)
+    return dict_to_message(fields, message)
+
+
+class Rule:
+    """一条自动处理规则
+
+    method 是匹配方法名的正则（不区分大小写）；when 是请求字段的条件 {"字段.子字段": 值}，
+    全部相等时才匹配，枚举字段用数字。匹配后不经过界面拦截：error 不为空时直接返回
+    {"code": "UNAVAILABLE", "details": "..."} 指定的错误状态；mock 为 true 时不转发，
+    返回按 response 生成的响应；否则用 request 中的字段覆盖请求后转发，再用 response
+    中的字段覆盖上游的响应。request 和 response 中的字符串可以用 ${字段} 引用请求的字段。
+    """
+    def __init__(self, method, when=None, mock=False, request=None, response=None, error=None):
+        self.pattern = re.compile(method, re.IGNORECASE)
+        self.conditions = [(tuple(path.split(".")), value) for path, value in (when or {}).items()]
+        self.mock = mock
+        self.request = compile_template(request) if request else None
+        self.response = compile_template(response) if response else None
+        self.error = None
+        if error is not None:
+            self.error = (grpc.StatusCode[error.get("code", "UNKNOWN").upper()], error.get("details", ""))
+
+    def matches(self, request):
+        try:
+            return all(field_value(request, path) == value for path, value in self.conditions)
+        except AttributeError:
+            return False
+
+    def mock_response(self, method, request):
+        response = method.response_class()
+        if self.response is not None:
+            dict_to_message(self.response(request), response)
+        return response
+
+    def rewrite_request(self, request):
+        return override_fields(request, self.request(request)) if self.request is not None else request
+
+    def rewrite_response(self, response, request):
+        return override_fields(response, self.response(request)) if self.response is not None else response
+
+
+def load_rules(path):
+    """从 JSON 文件读取规则列表"""
+    with open(path, encoding="utf-8") as f:
+        return [Rule(**rule) for rule in json.load(f)]
+
+
+class RuleSet:
+    """按顺序使用第一条匹配的规则
+
+    每个方法第一次调用时筛选出方法名匹配的规则，之后只检查请求字段的条件。设置了 path 时
+    后台线程定期检查文件，修改后重新加载并整体替换，加载失败时保留原来的规则。
+    """
+    def __init__(self, path=None, rules=(), reload_interval=RULES_RELOAD_INTERVAL):
+        self.path = path
+        self.mtime = None
+        self.snapshot = (list(rules), {})  # (规则, {方法名: 方法名匹配的规则})
+        if path is not None:
+            self.mtime = os.stat(path).st_mtime_ns
+            self.snapshot = (load_rules(path), {})
+            if reload_interval:
+                threading.Thread(target=self.watch, args=(reload_interval,), daemon=True).start()
+
+    def __len__(self):
+        return len(self.snapshot[0])
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            self.reload()
+
+    def reload(self):
+        """文件修改过时重新加载，返回是否加载了新规则"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return False
+            # 先记录修改时间，文件有错误时只报告一次
+            self.mtime = mtime
+            self.snapshot = (load_rules(self.path), {})
+            print(f"已重新加载 {len(self)} 条规则: {self.path}")
+            return True
+        except Exception:
+            print(traceback.format_exc())
+            return False
+
+    def candidates(self, method):
+        rules, by_method = self.snapshot
+        matched = by_method.get(method.name)
+        if matched is None:
+            matched = by_method[method.name] = tuple(rule for rule in rules if rule.pattern.search(method.name))
+        return matched
+
+    def match(self, method, request):
+        for rule in self.candidates(method):
+            if rule.matches(request):
+                return rule
+        return None
@@ -0,0 +1,33 @@
+import pytest
+
+from grpc_proxy import SearchQuery
+from proxy_engine import CaptureStore
+
+
+@pytest.fixture
+def records():
+    store = CaptureStore()
+    service = store.service("ExampleService", None, None)
+    first = store.add(service, "UnaryMethod", '{"message": "order 42"}', "2024-01-01 00:00:00")
+    store.set_response(first, '{\n    "id": 7,\n    "name": "first"\n}')
+    second = store.add(service, "UnaryMethod", '{"message": "no digits"}', "2024-01-01 00:00:01")
+    store.set_response(second, '{\n    "id": 8,\n    "name": "second"\n}')
+    return store, first.id, second.id
+
+
+def search(store, text):
+    query = SearchQuery(text)
+    return [record.id for record in store if query.matches(record, store, str)]
+
+
+def test_backslash_kept_in_regex(records):
+    store, first, second = records
+    assert search(store, r"req:\d+") == [first]
+    assert search(store, r"\d{2}") == [first]
+
+
+def test_quoted_json_fragment(records):
+    store, first, second = records
+    assert search(store, "resp:'\"id\": 7'") == [first]
+    assert search(store, "'\"name\": \"second\"'") == [second]
+    assert search(store, '"id": 8') == [second]
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import pytest
+from google.protobuf import descriptor_pb2, descriptor_pool
+
+import headless
+import proxy_engine
+import proto.example_pb2 as example_pb2
+from proxy_engine import RawMessageList, decode_content
+
+
+def watch(request, context):
+    # 每 0.1 秒推送一条，客户端收到几条后取消
+    for i in range(int(request.message)):
+        time.sleep(0.1)
+        yield example_pb2.ExampleResponse(message=f"tick{i}")
+
+
+def feed_service():
+    # 示例 proto 中没有服务端流式方法，测试时注册一个 demo.Feed/Watch
+    pool = descriptor_pool.Default()
+    try:
+        return pool.FindServiceByName("demo.Feed")
+    except KeyError:
+        pass
+    file_proto = descriptor_pb2.FileDescriptorProto(name="demo_feed.proto", package="demo", syntax="proto3",
+                                                    dependency=[example_pb2.DESCRIPTOR.name])
+    file_proto.service.add(name="Feed").method.add(name="Watch", input_type=".example.ExampleRequest",
+                                                    output_type=".example.ExampleResponse", server_streaming=True)
+    pool.AddSerializedFile(file_proto.SerializeToString())
+    return pool.FindServiceByName("demo.Feed")
+
+
+class ListSink:
+    def __init__(self):
+        self.items = []
+
+    def submit(self, meta, request, response):
+        self.items.append((meta, request, response))
+
+
+@pytest.fixture(scope="module")
+def backend():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler("demo.Feed", {
+        "Watch": grpc.unary_stream_rpc_method_handler(
+            watch, example_pb2.ExampleRequest.FromString, example_pb2.ExampleResponse.SerializeToString)}),))
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    yield f"127.0.0.1:{port}"
+    server.stop(0)
+
+
+@pytest.mark.parametrize("engine, passthrough, port", [
+    ("sync", False, 50741),
+    ("sync", True, 50742),
+    ("aio", True, 50743),
+])
+def test_cancelled_stream_keeps_delivered_messages(backend, monkeypatch, engine, passthrough, port):
+    monkeypatch.setattr(proxy_engine, "PASSTHROUGH", passthrough)
+    sink = ListSink()
+    recorder = headless.HeadlessRecorder(sink)
+    start = proxy_engine.start_generic_server if engine == "sync" else proxy_engine.start_aio_generic_server
+    threading.Thread(target=start, args=(recorder, [feed_service()], [backend], port), daemon=True).start()
+
+    with grpc.insecure_channel(f"127.0.0.1:{port}") as channel:
+        grpc.channel_ready_future(channel).result(timeout=5)
+        call = channel.unary_stream("/demo.Feed/Watch", example_pb2.ExampleRequest.SerializeToString,
+                                    example_pb2.ExampleResponse.FromString)(example_pb2.ExampleRequest(message="50"),
+                                                                           timeout=10)
+        received = [next(call).message for _ in range(3)]
+        call.cancel()
+
+    deadline = time.time() + 5
+    while not sink.items and time.time() < deadline:
+        time.sleep(0.05)
+    assert len(sink.items) == 1
+    meta, _, response = sink.items[0]
+    assert meta["status"] == "出错"
+    assert meta["error"] == "客户端已断开"
+    assert meta["response_kind"] == "stream"
+    messages = decode_content(meta["response_kind"], meta["response_type"], response)
+    assert isinstance(messages, RawMessageList)
+    assert [message.decode().message for message in messages.messages][:3] == received